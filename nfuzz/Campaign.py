@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8  -*-
+'''
+@author: sunqiao
+@contact: sunqiao@corp.netease.com
+@time: 2021/5/17 10:10
+@desc:Fuzzing with Grammers
+MIT License
+
+Copyright (c) 2021 alexqiaodan
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+import hashlib
+import multiprocessing
+import random
+import time
+from collections import Counter
+
+if __package__ is None or __package__ == "":
+    from nfuzz.Crashes import CrashBuckets
+    from nfuzz.Fuzzer import Runner
+else:
+    from .Crashes import CrashBuckets
+    from .Fuzzer import Runner
+
+
+def worker_seed(seed, worker):
+    """The random seed of `worker`, derived from the campaign's `seed`"""
+    digest = hashlib.blake2b(("%r/%d" % (seed, worker)).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+def shard(trials, workers):
+    """Split `trials` into `workers` nearly equal parts"""
+    return [trials // workers + (i < trials % workers) for i in range(workers)]
+
+
+class WorkerStats(object):
+    """What one worker did: outcome counts, failures by signature, time"""
+
+    def __init__(self, worker, seed, max_exemplars):
+        self.worker = worker
+        self.seed = seed
+        self.trials = 0
+        self.outcomes = Counter()
+        self.failures = CrashBuckets(max_exemplars)
+        self.elapsed = 0.0
+
+
+def run_worker(make_fuzzer, make_runner, worker, seed, trials, max_exemplars):
+    """Run one shard of a campaign in this process; return its `WorkerStats`"""
+    random.seed(seed)
+    fuzzer = make_fuzzer()
+    runner = make_runner()
+    stats = WorkerStats(worker, seed, max_exemplars)
+    start = time.time()
+    for i in range(trials):
+        result, outcome = fuzzer.run(runner)
+        stats.outcomes[outcome] += 1
+        if outcome == Runner.FAIL:
+            stats.failures.add(runner.failure_signature(result), fuzzer.inp)
+    stats.trials = trials
+    stats.elapsed = time.time() - start
+    return stats
+
+
+def _worker_main(connection, *args):
+    try:
+        connection.send(run_worker(*args))
+    except BaseException as exc:
+        connection.send(exc)
+        raise
+    finally:
+        connection.close()
+
+
+class CampaignResult(object):
+    """Merged results of all workers; `workers` has each `WorkerStats`"""
+
+    def __init__(self, workers, max_exemplars, elapsed):
+        self.workers = workers
+        self.elapsed = elapsed
+        self.trials = sum(stats.trials for stats in workers)
+        self.outcomes = Counter()
+        self.failures = CrashBuckets(max_exemplars)
+        for stats in workers:  # In worker order, so merging is deterministic
+            self.outcomes.update(stats.outcomes)
+            self.failures.merge(stats.failures)
+
+    def execs_per_second(self):
+        return self.trials / self.elapsed if self.elapsed else 0.0
+
+
+class ParallelCampaign(object):
+    """Run `trials` of a fuzzer and a runner, sharded over `workers`
+    processes.
+
+    `make_fuzzer` and `make_runner` create the fuzzer and the runner in
+    each worker (e.g. a class, or a `functools.partial`); they must be
+    picklable unless processes are forked.  Worker `i` seeds `random` with
+    `worker_seed(seed, i)`, so for a given `seed` and number of workers,
+    every run of the campaign has the same outcomes and failures.
+    Results are sent back over a pipe once each worker is done."""
+
+    def __init__(self, make_fuzzer, make_runner, workers=None, seed=0, max_exemplars=5,
+                 context=None):
+        self.make_fuzzer = make_fuzzer
+        self.make_runner = make_runner
+        self.workers = workers or multiprocessing.cpu_count()
+        self.seed = seed
+        self.max_exemplars = max_exemplars
+        self.context = context or multiprocessing.get_context()
+
+    def run(self, trials):
+        """Run the campaign; return a `CampaignResult`"""
+        start = time.time()
+        processes = []
+        for worker, worker_trials in enumerate(shard(trials, self.workers)):
+            receiver, sender = self.context.Pipe(duplex=False)
+            process = self.context.Process(
+                target=_worker_main,
+                args=(sender, self.make_fuzzer, self.make_runner, worker,
+                      worker_seed(self.seed, worker), worker_trials, self.max_exemplars))
+            process.start()
+            sender.close()
+            processes.append((process, receiver))
+
+        workers = []
+        try:
+            for process, receiver in processes:
+                try:
+                    stats = receiver.recv()
+                except EOFError:
+                    process.join()
+                    raise RuntimeError("campaign worker died (exit code %s)" %
+                                       process.exitcode)
+                if isinstance(stats, BaseException):
+                    raise stats
+                workers.append(stats)
+        finally:
+            for process, receiver in processes:
+                receiver.close()
+                if process.is_alive() and len(workers) < len(processes):
+                    process.terminate()
+                process.join()
+        return CampaignResult(workers, self.max_exemplars, time.time() - start)
+
+
+if __name__ == "__main__":
+    '''把 GrammarFuzzer 的 trials 分给多个进程执行; 相同种子与进程数的结果可复现'''
+    from functools import partial
+
+    if __package__ is None or __package__ == "":
+        from nfuzz.GrammarFuzzer import GrammarFuzzer
+        from nfuzz.Grammars import EXPR_GRAMMAR
+        from nfuzz.MutationFuzzer import FunctionRunner
+    else:
+        from .GrammarFuzzer import GrammarFuzzer
+        from .Grammars import EXPR_GRAMMAR
+        from .MutationFuzzer import FunctionRunner
+
+    def evaluate(expr):
+        return eval(expr)
+
+    make_fuzzer = partial(GrammarFuzzer, EXPR_GRAMMAR, max_nonterminals=20)
+    make_runner = partial(FunctionRunner, evaluate)
+    trials = 4000
+    for workers in [1, 2, 4]:
+        campaign = ParallelCampaign(make_fuzzer, make_runner, workers=workers, seed=42)
+        result = campaign.run(trials)
+        again = campaign.run(trials)
+        assert again.outcomes == result.outcomes
+        assert again.failures.summary() == result.failures.summary()
+        print("%d worker(s): %6.0f execs/s, %s, %d failure signature(s)" %
+              (workers, result.execs_per_second(), dict(result.outcomes), len(result.failures)))
+    for signature, count, smallest in result.failures.summary():
+        print("  %-30s %5d  %r" % (signature, count, smallest))
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8  -*-
+'''
+@author: sunqiao
+@contact: sunqiao@corp.netease.com
+@time: 2021/4/20 10:12
+@desc:Fuzzing with Grammers
+MIT License
+
+Copyright (c) 2021 alexqiaodan
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+from array import array
+
+if __package__ is None or __package__ == "":
+    from nfuzz.Grammars import is_nonterminal
+else:
+    from .Grammars import is_nonterminal
+
+
+class SymbolTable(object):
+    """Interns symbols to integer ids"""
+
+    def __init__(self):
+        self.symbols = []
+        self.ids = {}
+        self.terminal_lengths = []  # symbol id -> length, 0 for nonterminals
+
+    def intern(self, symbol):
+        sid = self.ids.get(symbol)
+        if sid is None:
+            sid = len(self.symbols)
+            self.ids[symbol] = sid
+            self.symbols.append(symbol)
+            self.terminal_lengths.append(
+                0 if is_nonterminal(symbol) else len(symbol))
+        return sid
+
+    def __getitem__(self, sid):
+        return self.symbols[sid]
+
+    def __len__(self):
+        return len(self.symbols)
+
+
+class CompactTree(object):
+    """A derivation tree stored in parallel arrays.
+
+    Node `n` has the symbol id `symbol[n]`, its parent `parent[n]`, its first
+    child `first_child[n]` and its next sibling `next_sibling[n]`.  Nodes are
+    numbered in preorder, starting with the root `0`.  All terminals are
+    stored once in `text`; the yield of node `n` is `text[start[n]:end[n]]`.
+    Unless given a `SymbolTable` to share, each tree interns its symbols in
+    a table of its own, which goes away with it."""
+
+    NONE = -1  # No parent, child or sibling
+    OPEN = -2  # `first_child` of an unexpanded nonterminal
+
+    def __init__(self, symbols=None):
+        self.symbols = SymbolTable() if symbols is None else symbols
+        self.symbol = array('i')
+        self.parent = array('i')
+        self.first_child = array('i')
+        self.next_sibling = array('i')
+        self.start = array('i')
+        self.end = array('i')
+        self.text = ""
+
+    @classmethod
+    def from_tree(cls, tree, symbols=None):
+        """Convert the `(symbol, children)` tree `tree`"""
+        self = cls(symbols)
+        symbols = self.symbols
+        intern = symbols.intern
+        symbol = self.symbol
+        parent = self.parent
+        first_child = self.first_child
+        next_sibling = self.next_sibling
+        start = self.start
+        terminal_lengths = symbols.terminal_lengths
+        last_child = array('i')
+        strings = []
+        length = 0
+
+        stack = [(tree, cls.NONE)]
+        while stack:
+            node, parent_id = stack.pop()
+            node_id = len(symbol)
+            node_symbol, children = node[0], node[1]
+            sid = intern(node_symbol)
+            symbol.append(sid)
+            parent.append(parent_id)
+            next_sibling.append(cls.NONE)
+            last_child.append(cls.NONE)
+            start.append(length)
+
+            # Preorder visits the children of a node in order
+            if parent_id != cls.NONE:
+                if last_child[parent_id] == cls.NONE:
+                    first_child[parent_id] = node_id
+                else:
+                    next_sibling[last_child[parent_id]] = node_id
+                last_child[parent_id] = node_id
+
+            if children is None:
+                first_child.append(cls.OPEN)
+            else:
+                first_child.append(cls.NONE)
+                if children:
+                    for child in reversed(children):
+                        stack.append((child, node_id))
+                elif terminal_lengths[sid]:
+                    strings.append(node_symbol)
+                    length += terminal_lengths[sid]
+
+        self.text = ''.join(strings)
+
+        # A subtree ends where its last terminal ends
+        end = array('i', start)
+        for node_id in range(len(symbol) - 1, -1, -1):
+            if first_child[node_id] == cls.NONE:
+                end[node_id] += terminal_lengths[symbol[node_id]]
+            parent_id = parent[node_id]
+            if parent_id != cls.NONE and end[node_id] > end[parent_id]:
+                end[parent_id] = end[node_id]
+        self.end = end
+        return self
+
+    def __len__(self):
+        """The number of nodes"""
+        return len(self.symbol)
+
+    def __str__(self):
+        return self.text
+
+    def symbol_of(self, node_id):
+        return self.symbols[self.symbol[node_id]]
+
+    def is_open(self, node_id):
+        """True if `node_id` is a nonterminal not expanded yet"""
+        return self.first_child[node_id] == self.OPEN
+
+    def children(self, node_id):
+        """Return the ids of the children of `node_id`"""
+        child = self.first_child[node_id]
+        children = []
+        while child >= 0:
+            children.append(child)
+            child = self.next_sibling[child]
+        return children
+
+    def string(self, node_id=0):
+        """Return the string derived from `node_id`, like `tree_to_string()`"""
+        return self.text[self.start[node_id]:self.end[node_id]]
+
+    def possible_expansions(self):
+        """Return the number of unexpanded nonterminals"""
+        return self.first_child.tolist().count(self.OPEN)
+
+    def to_tree(self, node_id=0):
+        """Return the subtree at `node_id` as `(symbol, children)` tuples"""
+        symbols = self.symbols
+        symbol = self.symbol
+        first_child = self.first_child
+        next_sibling = self.next_sibling
+
+        root = None
+        # (node id, children list of the parent)
+        stack = [(node_id, None)]
+        while stack:
+            node_id, siblings = stack.pop()
+            child = first_child[node_id]
+            if child == self.OPEN:
+                node = (symbols[symbol[node_id]], None)
+            else:
+                children = []
+                node = (symbols[symbol[node_id]], children)
+                child_ids = []
+                while child >= 0:
+                    child_ids.append(child)
+                    child = next_sibling[child]
+                for child in reversed(child_ids):
+                    stack.append((child, children))
+
+            if siblings is None:
+                root = node
+            else:
+                siblings.append(node)
+        return root
+
+
+if __name__ == "__main__":
+    '''对比经典派生树与 CompactTree 的内存占用 (tracemalloc) 与 GC 对象数'''
+    import gc
+    import random
+    import tracemalloc
+
+    if __package__ is None or __package__ == "":
+        from nfuzz.GrammarFuzzer import GrammarFuzzer, tree_to_string
+        from nfuzz.Grammars import EXPR_GRAMMAR
+    else:
+        from .GrammarFuzzer import GrammarFuzzer, tree_to_string
+        from .Grammars import EXPR_GRAMMAR
+
+    random.seed(0)
+    f = GrammarFuzzer(EXPR_GRAMMAR, min_nonterminals=50, max_nonterminals=200)
+    trials = 100
+
+    def measure(make):
+        gc.collect()
+        objects = len(gc.get_objects())
+        tracemalloc.start()
+        trees = make()
+        size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        objects = len(gc.get_objects()) - objects
+        return trees, size, objects
+
+    # Generate first, then measure what it takes to keep the trees
+    classic = [f.fuzz_tree() for i in range(trials)]
+    symbols = SymbolTable()  # One table for all trees of the grammar
+    compact = [CompactTree.from_tree(tree, symbols) for tree in classic]
+    nodes = sum(len(tree) for tree in compact)
+    for tree, compact_tree in zip(classic, compact):
+        assert tree_to_string(tree) == str(compact_tree)
+        assert compact_tree.to_tree() == tree
+    del classic
+
+    classic, classic_size, classic_objects = measure(
+        lambda: [tree.to_tree() for tree in compact])
+    compact, compact_size, compact_objects = measure(
+        lambda: [CompactTree.from_tree(tree, symbols) for tree in classic])
+
+    print("%d trees, %d nodes" % (trials, nodes))
+    print("classic: %8.1f bytes/node, %6d GC objects" %
+          (classic_size / nodes, classic_objects))
+    print("compact: %8.1f bytes/node, %6d GC objects" %
+          (compact_size / nodes, compact_objects))
@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8  -*-
+'''
+@author: sunqiao
+@contact: sunqiao@corp.netease.com
+@time: 2021/4/25 16:40
+@desc:Fuzzing with Grammers
+MIT License
+
+Copyright (c) 2021 alexqiaodan
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+import sys
+import time
+import zlib
+
+
+class Coverage(object):
+    """Collect the lines executed in a `with` block, and the branches
+    between them (pairs of consecutive lines)"""
+
+    def __init__(self):
+        self._lines = set()
+        self._branches = set()
+        self._last = None
+        self.original_trace_function = None
+
+    # Tracing function
+    def traceit(self, frame, event, arg):
+        if self.original_trace_function is not None:
+            self.original_trace_function(frame, event, arg)
+
+        if event == "line":
+            location = (frame.f_code.co_name, frame.f_lineno)
+            self._lines.add(location)
+            self._branches.add((self._last, location))
+            self._last = location
+
+        return self.traceit
+
+    # Begin of `with` block
+    def __enter__(self):
+        self.original_trace_function = sys.gettrace()
+        sys.settrace(self.traceit)
+        return self
+
+    # End of `with` block
+    def __exit__(self, exc_type, exc_value, tb):
+        sys.settrace(self.original_trace_function)
+
+    def coverage(self):
+        """The set of executed `(function name, line number)` locations"""
+        return self._lines
+
+    def branch_coverage(self):
+        """The set of executed `(location, next location)` pairs"""
+        return self._branches
+
+    def function_names(self):
+        """The names of all executed functions"""
+        return set(function_name for (function_name, line_number) in self._lines)
+
+
+MAP_SIZE = 1 << 16  # Entries in an edge bitmap
+MAX_BASES = 1 << 14  # Code objects whose location hash is kept
+
+def _location_base(code):
+    """A hash of `code` that is the same in every process"""
+    key = "%s:%s:%d" % (code.co_filename, code.co_name, code.co_firstlineno)
+    return zlib.crc32(key.encode('utf-8', 'surrogateescape'))
+
+
+class EdgeCoverage(object):
+    """Collect the edges executed in a `with` block into a bitmap.
+
+    `bitmap` is a `bytearray` of `map_size` entries; an entry is set to 1
+    if an edge hashing to it was executed.  Edges are transitions between
+    consecutive lines, as in AFL.  On Python 3.14 and later,
+    `sys.monitoring` reports the branches taken, and every location is
+    disabled after its first hit, so that code runs at full speed after
+    that.  Elsewhere, every line executed costs a callback; `sys.settrace`
+    is used by default, as it is as fast as `sys.monitoring` there."""
+
+    def __init__(self, map_size=MAP_SIZE, use_monitoring=None):
+        """If `use_monitoring` is False, always use `sys.settrace`; if True,
+        use `sys.monitoring` where there is one"""
+        assert map_size & (map_size - 1) == 0, "map_size must be a power of 2"
+        self.map_size = map_size
+        self.bitmap = bytearray(map_size)
+        self._zeros = bytes(map_size)
+        self._bases = {}  # code object -> location hash, or None to skip
+        if use_monitoring is None:
+            use_monitoring = (hasattr(sys, "monitoring")
+                              and hasattr(sys.monitoring.events, "BRANCH_LEFT"))
+        self.use_monitoring = use_monitoring and hasattr(sys, "monitoring")
+        self.original_trace_function = None
+        self._tool_id = None
+
+    def reset(self):
+        """Clear the bitmap, in place"""
+        self.bitmap[:] = self._zeros
+
+    def _base(self, code):
+        # Code objects hash their contents, so look them up by id; keeping
+        # `code` in the entry makes sure the id is not reused.  Start over
+        # once there are too many, so that dead code can be freed.
+        entry = self._bases.get(id(code))
+        if entry is None:
+            if len(self._bases) >= MAX_BASES:
+                self._bases.clear()
+            base = None if code in _COLLECTOR_CODE else _location_base(code)
+            entry = self._bases[id(code)] = (code, base)
+        return entry[1]
+
+    # Begin of `with` block
+    def __enter__(self):
+        if self.use_monitoring and self._start_monitoring():
+            return self
+        self.original_trace_function = sys.gettrace()
+        sys.settrace(self._make_tracer())
+        return self
+
+    # End of `with` block
+    def __exit__(self, exc_type, exc_value, tb):
+        if self._tool_id is not None:
+            self._stop_monitoring()
+        else:
+            sys.settrace(self.original_trace_function)
+
+    def _make_tracer(self):
+        bitmap = self.bitmap
+        mask = self.map_size - 1
+        base_of = self._base
+        tracers = {}  # code id -> local trace function, or None
+        prev = 0
+
+        def make_trace_line(base):
+            def trace_line(frame, event, arg):
+                nonlocal prev
+                if event == "line":
+                    location = (base + frame.f_lineno * 0x9E3779B1) & mask
+                    bitmap[location ^ prev] = 1
+                    prev = location >> 1
+                return trace_line
+            return trace_line
+
+        def traceit(frame, event, arg):
+            code = frame.f_code
+            try:
+                return tracers[id(code)]
+            except KeyError:
+                base = base_of(code)
+                tracer = tracers[id(code)] = None if base is None else make_trace_line(base)
+                return tracer
+
+        return traceit
+
+    def _start_monitoring(self):
+        monitoring = sys.monitoring
+        events = monitoring.events
+        for tool_id in (monitoring.COVERAGE_ID, 2, 3, 4):
+            if monitoring.get_tool(tool_id) is None:
+                break
+        else:
+            return False  # All taken (by coverage.py, a debugger, ...)
+        monitoring.use_tool_id(tool_id, "nfuzz")
+        self._tool_id = tool_id
+
+        bitmap = self.bitmap
+        mask = self.map_size - 1
+        base_of = self._base
+        DISABLE = monitoring.DISABLE
+        prev = 0
+
+        def on_line(code, line_number):
+            base = base_of(code)
+            if base is not None:
+                bitmap[(base + line_number * 0x9E3779B1) & mask] = 1
+            return DISABLE
+
+        def on_line_edge(code, line_number):
+            # Same hash as the `sys.settrace` tracer
+            nonlocal prev
+            base = base_of(code)
+            if base is None:
+                return DISABLE
+            location = (base + line_number * 0x9E3779B1) & mask
+            bitmap[location ^ prev] = 1
+            prev = location >> 1
+
+        def on_branch(code, offset, destination):
+            base = base_of(code)
+            if base is not None:
+                bitmap[(base ^ (offset * 0x85EBCA6B) ^ (destination * 0xC2B2AE35)) & mask] = 1
+            return DISABLE
+
+        chosen = events.LINE
+        if hasattr(events, "BRANCH_LEFT"):
+            # Python 3.14+: each direction of a branch is reported, and
+            # disabled, on its own
+            monitoring.register_callback(tool_id, events.LINE, on_line)
+            monitoring.register_callback(tool_id, events.BRANCH_LEFT, on_branch)
+            monitoring.register_callback(tool_id, events.BRANCH_RIGHT, on_branch)
+            chosen |= events.BRANCH_LEFT | events.BRANCH_RIGHT
+        else:
+            # Before, disabling a BRANCH event would hide the other
+            # direction, so record pairs of consecutive lines instead, and
+            # keep every line enabled
+            monitoring.register_callback(tool_id, events.LINE, on_line_edge)
+
+        # Locations disabled in earlier runs count again
+        monitoring.restart_events()
+        monitoring.set_events(tool_id, chosen)
+        return True
+
+    def _stop_monitoring(self):
+        monitoring = sys.monitoring
+        monitoring.set_events(self._tool_id, 0)
+        monitoring.free_tool_id(self._tool_id)
+        self._tool_id = None
+
+    def edges(self):
+        """The number of bitmap entries set"""
+        return self.map_size - self.bitmap.count(0)
+
+    def coverage(self):
+        """The set of bitmap entries set"""
+        bitmap = self.bitmap
+        covered = set()
+        i = bitmap.find(1)
+        while i >= 0:
+            covered.add(i)
+            i = bitmap.find(1, i + 1)
+        return covered
+
+    def digest(self):
+        """A hash of the bitmap, e.g. to tell paths apart"""
+        return zlib.crc32(self.bitmap)
+
+    def merge_into(self, total):
+        """Set the entries of our bitmap in the bitmap `total` (a `bytearray`
+        of the same size); return the number of entries that were new"""
+        ours = int.from_bytes(self.bitmap, 'little')
+        theirs = int.from_bytes(total, 'little')
+        new = ours & ~theirs
+        if new:
+            total[:] = (ours | theirs).to_bytes(self.map_size, 'little')
+        return bin(new).count("1")
+
+
+if __name__ == "__main__":
+    '''统计 urlparse 执行的代码行与分支'''
+    from urllib.parse import urlparse
+
+    with Coverage() as cov:
+        urlparse("https://www.lofter.com/?q=fuzzing")
+    print(len(cov.coverage()), "lines,", len(cov.branch_coverage()), "branches in",
+          sorted(cov.function_names()))
+
+
+def _code_objects(function):
+    """The code of `function` and of the functions nested in it"""
+    codes = []
+    stack = [function.__code__]
+    while stack:
+        code = stack.pop()
+        codes.append(code)
+        stack.extend(const for const in code.co_consts if hasattr(const, "co_code"))
+    return codes
+
+
+# Not recorded: the collector's own frames
+_COLLECTOR_CODE = frozenset(code for function in vars(EdgeCoverage).values()
+                            if hasattr(function, "__code__")
+                            for code in _code_objects(function))
+
+
+def cgi_decode(s):
+    """Decode the CGI-encoded string `s`"""
+    hex_values = {
+        '0': 0, '1': 1, '2': 2, '3': 3, '4': 4,
+        '5': 5, '6': 6, '7': 7, '8': 8, '9': 9,
+        'a': 10, 'b': 11, 'c': 12, 'd': 13, 'e': 14, 'f': 15,
+        'A': 10, 'B': 11, 'C': 12, 'D': 13, 'E': 14, 'F': 15,
+    }
+
+    t = ""
+    i = 0
+    while i < len(s):
+        c = s[i]
+        if c == '+':
+            t += ' '
+        elif c == '%':
+            digit_high, digit_low = s[i + 1], s[i + 2]
+            i += 2
+            if digit_high in hex_values and digit_low in hex_values:
+                v = hex_values[digit_high] * 16 + hex_values[digit_low]
+                t += chr(v)
+            else:
+                raise ValueError("Invalid encoding")
+        else:
+            t += c
+        i += 1
+    return t
+
+
+if __name__ == "__main__":
+    '''覆盖率收集的额外开销：与不追踪的运行相比'''
+    inp = "Hello+World%21+" * 200
+    runs = 200
+
+    def untraced():
+        for i in range(runs):
+            cgi_decode(inp)
+
+    def traced(make_collector):
+        for i in range(runs):
+            with make_collector():
+                cgi_decode(inp)
+
+    start_time = time.perf_counter()
+    untraced()
+    baseline = time.perf_counter() - start_time
+    print("untraced: %.1f ms for %d runs" % (baseline * 1000, runs))
+
+    edges = EdgeCoverage(use_monitoring=False)
+    fast = EdgeCoverage()
+
+    def reuse(collector):
+        collector.reset()
+        return collector
+
+    for name, make_collector in [("Coverage (settrace, sets)", Coverage),
+                                 ("EdgeCoverage (settrace)", lambda: reuse(edges)),
+                                 ("EdgeCoverage (%s)" % ("sys.monitoring" if fast.use_monitoring
+                                                         else "settrace"),
+                                  lambda: reuse(fast))]:
+        start_time = time.perf_counter()
+        traced(make_collector)
+        elapsed = time.perf_counter() - start_time
+        print("%-30s %6.1fx slower" % (name, elapsed / baseline))
+    print("edges:", edges.edges(), "settrace,", fast.edges(), "last collector")
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8  -*-
+'''
+@author: sunqiao
+@contact: sunqiao@corp.netease.com
+@time: 2021/5/10 16:05
+@desc:Fuzzing with Grammers
+MIT License
+
+Copyright (c) 2021 alexqiaodan
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+import os
+import re
+import signal
+import zlib
+
+# Addresses, pids and other numbers that differ between runs of the same bug
+_VOLATILE = re.compile(r"0x[0-9a-fA-F]+|\d+")
+
+
+def exception_signature(exc, depth=5):
+    """Return a signature for `exc`: its type and a hash of the innermost
+    `depth` frames of its traceback (file name, function, line)"""
+    frames = []
+    tb = exc.__traceback__
+    while tb is not None:
+        code = tb.tb_frame.f_code
+        frames.append((os.path.basename(code.co_filename), code.co_name, tb.tb_lineno))
+        tb = tb.tb_next
+    digest = zlib.crc32(repr(frames[-depth:]).encode())
+    return "%s:%08x" % (type(exc).__name__, digest)
+
+
+def program_signature(result, lines=3, tail=4096):
+    """Return a signature for the `subprocess.CompletedProcess` `result`:
+    the signal (or exit code) and a hash of the last `lines` lines of
+    stderr, with numbers masked.  Only the last `tail` characters of
+    stderr are looked at."""
+    if result.returncode < 0:
+        try:
+            status = signal.Signals(-result.returncode).name
+        except ValueError:
+            status = "SIG%d" % -result.returncode
+    else:
+        status = "EXIT%d" % result.returncode
+
+    stderr = result.stderr or ""
+    if isinstance(stderr, bytes):
+        stderr = stderr[-tail:].decode("utf-8", "replace")
+    else:
+        stderr = stderr[-tail:]
+    last_lines = [line for line in stderr.splitlines() if line.strip()][-lines:]
+    digest = zlib.crc32(_VOLATILE.sub("#", "\n".join(last_lines)).encode())
+    return "%s:%08x" % (status, digest)
+
+
+class CrashBucket(object):
+    """The failures with one signature: their number, and up to
+    `max_exemplars` of the smallest inputs"""
+
+    def __init__(self, signature, first_seen):
+        self.signature = signature
+        self.count = 0
+        self.first_seen = first_seen  # Index of the first failure overall
+        self.exemplars = []  # Sorted by length
+
+    def add(self, inp, max_exemplars):
+        self.count += 1
+        exemplars = self.exemplars
+        if len(exemplars) == max_exemplars and len(inp) >= len(exemplars[-1]):
+            return
+        if inp in exemplars:
+            return
+        i = len(exemplars)
+        while i > 0 and len(exemplars[i - 1]) > len(inp):
+            i -= 1
+        exemplars.insert(i, inp)
+        del exemplars[max_exemplars:]
+
+
+class CrashBuckets(object):
+    """Index of failures by signature.  Memory is bounded by the number of
+    distinct signatures: each bucket keeps only its `max_exemplars`
+    smallest inputs."""
+
+    def __init__(self, max_exemplars=5):
+        self.max_exemplars = max_exemplars
+        self.buckets = {}  # signature -> CrashBucket
+        self.total = 0
+
+    def add(self, signature, inp):
+        """Record a failure of `inp`; return True if `signature` is new"""
+        bucket = self.buckets.get(signature)
+        new = bucket is None
+        if new:
+            bucket = self.buckets[signature] = CrashBucket(signature, self.total)
+        bucket.add(inp, self.max_exemplars)
+        self.total += 1
+        return new
+
+    def merge(self, other):
+        """Add the failures recorded in the `CrashBuckets` `other`"""
+        for bucket in other:
+            mine = self.buckets.get(bucket.signature)
+            if mine is None:
+                mine = self.buckets[bucket.signature] = CrashBucket(
+                    bucket.signature, self.total + bucket.first_seen)
+            for inp in bucket.exemplars:
+                mine.add(inp, self.max_exemplars)
+            mine.count += bucket.count - len(bucket.exemplars)
+        self.total += other.total
+
+    def __len__(self):
+        """The number of distinct signatures"""
+        return len(self.buckets)
+
+    def __iter__(self):
+        return iter(self.buckets.values())
+
+    def __contains__(self, signature):
+        return signature in self.buckets
+
+    def __getitem__(self, signature):
+        return self.buckets[signature]
+
+    def summary(self):
+        """Return `(signature, count, smallest input)`, most frequent first"""
+        return [(bucket.signature, bucket.count, bucket.exemplars[0])
+                for bucket in sorted(self.buckets.values(),
+                                     key=lambda bucket: (-bucket.count, bucket.first_seen))]
+
+
+if __name__ == "__main__":
+    '''对大量随机输入触发的失败按签名分桶: 函数按异常类型与栈帧, 程序按信号与 stderr 指纹'''
+    import random
+    import sys
+    import time
+
+    if __package__ is None or __package__ == "":
+        from nfuzz.Fuzzer import ProgramRunner, Runner, fuzzer
+        from nfuzz.MutationFuzzer import FunctionRunner
+    else:
+        from .Fuzzer import ProgramRunner, Runner, fuzzer
+        from .MutationFuzzer import FunctionRunner
+
+    def parse_pair(s):
+        key, value = s.split("=", 1)  # ValueError without "="
+        if not key:
+            raise KeyError(s)
+        return key, int(value) // len(key)
+
+    random.seed(0)
+    runner = FunctionRunner(parse_pair)
+    buckets = CrashBuckets()
+    trials = 100000
+    start = time.time()
+    for i in range(trials):
+        inp = fuzzer(max_length=20, char_start=ord("0"), char_range=16)
+        result, outcome = runner.run(inp)
+        if outcome == Runner.FAIL:
+            buckets.add(runner.failure_signature(result), inp)
+    print("%d trials, %d failures, %d buckets, %.2fs" %
+          (trials, buckets.total, len(buckets), time.time() - start))
+    for signature, count, smallest in buckets.summary():
+        print("%-28s %6d  %r" % (signature, count, smallest))
+
+    program = ProgramRunner([sys.executable, "-c",
+                             "import os, sys; s = sys.stdin.read(); "
+                             "print('error at', id(s), file=sys.stderr); "
+                             "os.abort() if 'a' in s else os.kill(os.getpid(), 11)"])
+    buckets = CrashBuckets()
+    for inp in ["abc", "xyz", "aaa", "b"]:
+        result, outcome = program.run(inp)
+        buckets.add(program.failure_signature(result), inp)
+    for signature, count, smallest in buckets.summary():
+        print("%-28s %6d  %r" % (signature, count, smallest))
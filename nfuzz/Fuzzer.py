@@ -28,21 +28,77 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 '''
 import random
+import itertools
+import json
 import os
 import tempfile
+import time
 import subprocess
 
+try:
+    import numpy as np
+except ImportError:
+    np = None  # `fuzz_batch()` falls back to `fuzz()`
+
+if __package__ is None or __package__ == "":
+    from nfuzz.Crashes import CrashBuckets, program_signature
+else:
+    from .Crashes import CrashBuckets, program_signature
+
+
+_translation_tables = {}
+
+
+def translation_table(char_start, char_range):
+    """Return `(table, delete)` for `bytes.translate()` mapping random bytes
+    uniformly into [`char_start`, `char_start` + `char_range`): bytes that
+    would make the mapping uneven are deleted"""
+    key = (char_start, char_range)
+    if key not in _translation_tables:
+        assert 0 < char_range and char_start + char_range <= 256
+        table = bytes(char_start + b % char_range for b in range(256))
+        delete = bytes(range(256 - 256 % char_range, 256))
+        _translation_tables[key] = (table, delete)
+    return _translation_tables[key]
+
+
+def random_buffer(size):
+    """`size` random bytes; seeded from `random`, so that `random.seed()` applies"""
+    if np is not None and size >= 4096:
+        return np.random.default_rng(random.getrandbits(64)).bytes(size)
+    return random.randbytes(size)
+
+
+def random_bytes(length, char_start=32, char_range=32):
+    """`length` random bytes in the range [`char_start`, `char_start` + `char_range`),
+    drawn as whole buffers"""
+    table, delete = translation_table(char_start, char_range)
+    kept = 256 - len(delete)
+    out = b""
+    while len(out) < length:
+        # Draw enough to make up for the deleted bytes, most of the time
+        missing = length - len(out)
+        out += random_buffer(missing * 256 // kept + 16 * (kept < 256)).translate(table, delete)
+    return out[:length]
+
+
+def random_string(length, char_start=32, char_range=32):
+    """A string of `length` random characters in the range
+    [`char_start`, `char_start` + `char_range`)"""
+    if char_start + char_range <= 256:
+        return random_bytes(length, char_start, char_range).decode('latin-1')
+    if np is not None:
+        rng = np.random.default_rng(random.getrandbits(64))
+        chars = rng.integers(char_start, char_start + char_range, length)
+        return chars.astype('<u4').tobytes().decode('utf-32-le', 'surrogatepass')
+    return ''.join(map(chr, random.choices(range(char_start, char_start + char_range), k=length)))
+
 
 def fuzzer(max_length=100, char_start=32, char_range=32):
     """A string of up to `max_length` characters
-       in the range [`char_start`, `char_start` + `char_range`]"""
+       in the range [`char_start`, `char_start` + `char_range`)"""
     string_length = random.randrange(0, max_length + 1)
-    out = ""
-    for i in range(0, string_length):
-        # out += chr(random.randrange(char_start, char_start + char_range))
-        out.append(chr(random.randrange(char_start, char_start + char_range)))
-        out = ''.join(out)
-    return out
+    return random_string(string_length, char_start, char_range)
 
 
 # 命令行执行模式  根据fuzzer生成模糊数据，然后subprocess 执行
@@ -81,6 +137,11 @@ class Runner(object):
         """Run the runner with the given input"""
         return (inp, Runner.UNRESOLVED)
 
+    def failure_signature(self, result):
+        """Return a signature of the failure of the last run, which returned
+        `result`; failures with the same signature likely have the same cause"""
+        return self.FAIL
+
 
 
 class PrintRunner(Runner):
@@ -107,15 +168,20 @@ class ProgramRunner(Runner):
     def run(self, inp=""):
         """Run the program with `inp` as input.  Return test outcome based on result of `subprocess.run()`."""
         result = self.run_process(inp)
+        return (result, self.outcome(result))
 
+    def outcome(self, result):
+        """PASS on exit code 0, FAIL if killed by a signal, else UNRESOLVED"""
         if result.returncode == 0:
-            outcome = self.PASS
+            return self.PASS
         elif result.returncode < 0:
-            outcome = self.FAIL
+            return self.FAIL
         else:
-            outcome = self.UNRESOLVED
+            return self.UNRESOLVED
 
-        return (result, outcome)
+    def failure_signature(self, result):
+        """The signal and a fingerprint of the end of stderr"""
+        return program_signature(result)
 
 
 class BinaryProgramRunner(ProgramRunner):
@@ -137,45 +203,160 @@ class Fuzzer(object):
         """子类重写实现具体功能"""
         return ""
 
+    def fuzz_batch(self, n):
+        """Return a list of `n` fuzz inputs"""
+        return [self.fuzz() for i in range(n)]
+
     def run(self, runner=Runner()):
-        """Run `runner` with fuzz input"""
-        return runner.run(self.fuzz())
+        """Run `runner` with fuzz input, which is kept in `self.inp`"""
+        self.inp = self.fuzz()
+        return runner.run(self.inp)
 
     def runs(self, runner=PrintRunner(), trials=10):
         """Run `runner` with fuzz input, `trials` times"""
         # Note: the list comprehension below does not invoke self.run() for subclasses
         # return [self.run(runner) for i in range(trials)]
-        outcomes = []
-        for i in range(trials):
-            res = self.run(runner)
-            print(res)
-            outcomes.append(res)
-        return outcomes
+        return [(result, outcome) for (inp, result, outcome)
+                in self.iter_runs(runner, trials, verbose=True)]
+
+    def iter_runs(self, runner=Runner(), trials=None, time_budget=None,
+                  stop_on_fail=False, sinks=(), verbose=False):
+        """Run `runner` with fuzz input and yield `(inp, result, outcome)`
+        for each run, keeping nothing.  Stop after `trials` runs (None: no
+        limit), after `time_budget` seconds, or, with `stop_on_fail`, after
+        the first FAIL.  Each of `sinks` is called as `sink(inp, result,
+        outcome)`; with `verbose`, `(result, outcome)` is printed."""
+        deadline = None if time_budget is None else time.monotonic() + time_budget
+        for i in (itertools.count() if trials is None else range(trials)):
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            result, outcome = self.run(runner)
+            inp = getattr(self, "inp", None)
+            for sink in sinks:
+                sink(inp, result, outcome)
+            if verbose:
+                print((result, outcome))
+            yield inp, result, outcome
+            if stop_on_fail and outcome == Runner.FAIL:
+                break
+
+    def run_all(self, runner=Runner(), **kwargs):
+        """Consume `iter_runs(runner, **kwargs)`; return the number of runs"""
+        count = 0
+        for run in self.iter_runs(runner, **kwargs):
+            count += 1
+        return count
+
+
+# Sinks for `Fuzzer.iter_runs()`
+
+class OutcomeCounter(object):
+    """Count runs by outcome"""
+
+    def __init__(self):
+        self.counts = {}
+
+    def __call__(self, inp, result, outcome):
+        self.counts[outcome] = self.counts.get(outcome, 0) + 1
+
+
+class FailureSink(object):
+    """Add failing inputs to `buckets` (a `CrashBuckets`), by the
+    `failure_signature()` of `runner`"""
+
+    def __init__(self, runner, buckets=None):
+        self.runner = runner
+        self.buckets = CrashBuckets() if buckets is None else buckets
+
+    def __call__(self, inp, result, outcome):
+        if outcome == Runner.FAIL:
+            self.buckets.add(self.runner.failure_signature(result), inp)
+
+
+class JSONLinesSink(object):
+    """Write a JSON line with the input and the outcome of each run
+    (of those with an outcome in `outcomes`, if given) to `file`"""
+
+    def __init__(self, file, outcomes=None):
+        self.file = file
+        self.outcomes = outcomes
+
+    def __call__(self, inp, result, outcome):
+        if self.outcomes is None or outcome in self.outcomes:
+            if isinstance(inp, bytes):
+                inp = inp.decode("latin-1")
+            self.file.write(json.dumps({"input": inp, "outcome": outcome}) + "\n")
 
 
 class RandomFuzzer(Fuzzer):
     def __init__(self, min_length=10, max_length=100,
-                 char_start=32, char_range=32):
+                 char_start=32, char_range=32, as_bytes=False):
         """Produce strings of `min_length` to `max_length` characters
-           in the range [`char_start`, `char_start` + `char_range`]"""
+           in the range [`char_start`, `char_start` + `char_range`).
+           If `as_bytes` is set, produce `bytes` instead."""
         self.min_length = min_length
         self.max_length = max_length
         self.char_start = char_start
         self.char_range = char_range
+        self.as_bytes = as_bytes
+        assert not as_bytes or char_start + char_range <= 256
+
+    def random_data(self, length):
+        if self.as_bytes:
+            return random_bytes(length, self.char_start, self.char_range)
+        return random_string(length, self.char_start, self.char_range)
 
     def fuzz(self):
         string_length = random.randrange(self.min_length, self.max_length + 1)
-        out = ""
-        for i in range(0, string_length):
-            # out += chr(random.randrange(self.char_start,
-            #                             self.char_start + self.char_range))
-            out.append(chr(random.randrange(self.char_start, self.char_start + self.char_range)))
-            out = ''.join(out)
-        return out
+        return self.random_data(string_length)
+
+    def fuzz_batch(self, n):
+        """Return a list of `n` inputs, sliced from one buffer"""
+        if np is not None:
+            rng = np.random.default_rng(random.getrandbits(64))
+            ends = np.cumsum(rng.integers(self.min_length, self.max_length + 1, n)).tolist()
+        else:
+            ends = list(itertools.accumulate(
+                random.randrange(self.min_length, self.max_length + 1) for i in range(n)))
+        data = self.random_data(ends[-1] if ends else 0)
+        starts = [0] + ends[:-1]
+        return [data[start:end] for (start, end) in zip(starts, ends)]
 
 
 #demo 随机字符串模糊器
 # if __name__ == "__main__":
 #     random_fuzzer = RandomFuzzer(min_length=20, max_length=20)
 #     for i in range(10):
-#         print(random_fuzzer.fuzz())
\ No newline at end of file
+#         print(random_fuzzer.fuzz())
+
+if __name__ == "__main__":
+    '''随机字符串模糊器的生成速度'''
+    import time
+
+    random_fuzzer = RandomFuzzer(min_length=20, max_length=20)
+    for i in range(3):
+        print(random_fuzzer.fuzz())
+    print(fuzzer())
+
+    trials = 100000
+    for as_bytes in [False, True]:
+        random_fuzzer = RandomFuzzer(min_length=10, max_length=1000, as_bytes=as_bytes)
+        start_time = time.time()
+        for i in range(trials):
+            random_fuzzer.fuzz()
+        single = time.time() - start_time
+
+        start_time = time.time()
+        inputs = random_fuzzer.fuzz_batch(trials)
+        batched = time.time() - start_time
+        size = sum(len(inp) for inp in inputs)
+        print("%-5s fuzz(): %8.0f inputs/s, fuzz_batch(): %8.0f inputs/s, %.0f MB/s" %
+              ("bytes" if as_bytes else "str", trials / single, trials / batched,
+               size / batched / 1e6))
+
+    # Streaming runs: nothing is printed or kept, unlike `runs()`
+    counter = OutcomeCounter()
+    random_fuzzer = RandomFuzzer()
+    start_time = time.time()
+    count = random_fuzzer.run_all(Runner(), time_budget=1.0, sinks=[counter])
+    print("iter_runs(): %d runs in %.2fs, %s" % (count, time.time() - start_time, counter.counts))
@@ -28,7 +28,6 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 '''
 import random
-import copy
 if __package__ is None or __package__ == "":
     from nfuzz.nfuzz_utils import unicode_escape
 else:
@@ -36,10 +35,10 @@ else:
 
 if __package__ is None or __package__ == "":
     from nfuzz.Grammars import EXPR_EBNF_GRAMMAR, convert_ebnf_grammar, is_valid_grammar, exp_string, START_SYMBOL, EXPR_GRAMMAR, \
-        RE_NONTERMINAL, nonterminals, is_nonterminal
+        RE_NONTERMINAL, nonterminals, is_nonterminal, compile_grammar
 else:
     from .Grammars import EXPR_EBNF_GRAMMAR, convert_ebnf_grammar, is_valid_grammar, exp_string, START_SYMBOL, EXPR_GRAMMAR, \
-        RE_NONTERMINAL, nonterminals, is_nonterminal
+        RE_NONTERMINAL, nonterminals, is_nonterminal, compile_grammar
 
 if __package__ is None or __package__ == "":
     pass
@@ -55,6 +54,11 @@ else:
 from IPython.display import display
 import re
 
+try:
+    import numpy as np
+except ImportError:
+    np = None  # `fuzz_batch()` falls back to `fuzz()`
+
 if __name__ == "__main__":
     expr_grammar = convert_ebnf_grammar(EXPR_EBNF_GRAMMAR)
 
@@ -87,19 +91,24 @@ def display_tree(derivation_tree,
     # If we import display_tree, we also have to import its functions
     from graphviz import Digraph
 
-    counter = 0
-
     def traverse_tree(dot, tree, id=0):
-        (symbol, children, annotation) = extract_node(tree, id)
-        node_attr(dot, id, symbol, annotation)
-
-        if children:
-            for child in children:
-                nonlocal counter
+        counter = id
+        stack = [(tree, None)]
+        while stack:
+            tree, parent_id = stack.pop()
+            if parent_id is None:
+                node_id = id
+            else:
                 counter += 1
-                child_id = counter
-                edge_attr(dot, id, child_id)
-                traverse_tree(dot, child, child_id)
+                node_id = counter
+                edge_attr(dot, parent_id, node_id)
+
+            (symbol, children, annotation) = extract_node(tree, node_id)
+            node_attr(dot, node_id, symbol, annotation)
+
+            if children:
+                for child in reversed(children):
+                    stack.append((child, node_id))
 
     dot = Digraph(comment="Derivation Tree")
     graph_attr(dot)
@@ -136,18 +145,19 @@ def display_annotated_tree(tree, a_nodes, a_edges, log=False):
 
 def all_terminals(tree):
     '''获取派生树中所有节点'''
-    (symbol, children) = tree
-    if children is None:
-        # This is a nonterminal symbol not expanded yet
-        return symbol
-
-    if len(children) == 0:
-        # This is a terminal symbol
-        return symbol
-
-    # This is an expanded symbol:
-    # Concatenate all terminal symbols from all children
-    return ''.join([all_terminals(c) for c in children])
+    strings = []
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        children = node[1]
+        if children:
+            # This is an expanded symbol:
+            # Concatenate all terminal symbols from all children
+            stack.extend(reversed(children))
+        else:
+            # This is a terminal symbol, or a nonterminal not expanded yet
+            strings.append(node[0])
+    return ''.join(strings)
 
 
 '''验证获取派生树所有节点方法'''
@@ -164,11 +174,15 @@ def all_terminals(tree):
 
 def tree_to_string(tree):
     '''派生树转字符串'''
-    symbol, children, *_ = tree
-    if children:
-        return ''.join(tree_to_string(c) for c in children)
-    else:
-        return '' if is_nonterminal(symbol) else symbol
+    strings = []
+    stack = [tree]
+    while stack:
+        symbol, children, *_ = stack.pop()
+        if children:
+            stack.extend(reversed(children))
+        elif not is_nonterminal(symbol):
+            strings.append(symbol)
+    return ''.join(strings)
 
 '''验证派生树转字符串方法'''
 # if __name__ == "__main__":
@@ -182,6 +196,215 @@ def tree_to_string(tree):
 #     print(res)
 
 
+class ExpansionFrontier(object):
+    """The unexpanded nodes of a derivation tree.
+
+    Every open node is kept as a `(children, index)` slot with
+    `children[index]` being the node; the root lives in a list of its own.
+    Taking a node from the frontier and adding the nodes it expands into
+    costs O(1) per node."""
+
+    def __init__(self, tree):
+        self.root = [tree]
+        self.slots = []
+        self.add(self.root, 0)
+
+    def tree(self):
+        return self.root[0]
+
+    def __len__(self):
+        return len(self.slots)
+
+    def add(self, children, index):
+        """Add all open nodes in the subtree at `children[index]`"""
+        slots = self.slots
+        stack = [(children, index)]
+        while stack:
+            children, index = stack.pop()
+            node_children = children[index][1]
+            if node_children is None:
+                slots.append((children, index))
+                continue
+            # Most expansions have only leaves as children
+            for i in range(len(node_children)):
+                grandchildren = node_children[i][1]
+                if grandchildren is None:
+                    slots.append((node_children, i))
+                elif grandchildren:
+                    stack.append((node_children, i))
+
+    def pop(self, i):
+        """Remove the `i`-th open node from the frontier; return its slot"""
+        slots = self.slots
+        slot = slots[i]
+        last = slots.pop()
+        if i < len(slots):
+            slots[i] = last
+        return slot
+
+
+class BatchExpander(object):
+    """Expand many derivations at once, with NumPy.
+
+    All sentential forms of a batch are kept in one array of symbol ids
+    (`CompiledGrammar` ids), with a parallel array telling which derivation
+    each symbol belongs to.  In every round, each open nonterminal is
+    replaced by an expansion drawn from a per-symbol choice table.  Like
+    `GrammarFuzzer.expand_tree()`, a derivation first expands at maximum
+    cost until it has `min_nonterminals` open nonterminals, then randomly
+    until it has `max_nonterminals`, then at minimum cost; the number of
+    open nonterminals is checked once per round, not once per node."""
+
+    MAX_COST, RANDOM, MIN_COST = 0, 1, 2
+
+    # Random rounds before switching to minimum cost anyway
+    MAX_ROUNDS = 100
+
+    def __init__(self, compiled):
+        self.compiled = compiled
+        n = compiled.n_nonterminals
+
+        # All expansions, concatenated
+        exp_tokens = []
+        exp_start = []
+        exp_len = []
+        first = []  # symbol id -> index of its first expansion
+        for sid in range(n):
+            first.append(len(exp_start))
+            for tokens in compiled.expansions[sid]:
+                exp_start.append(len(exp_tokens))
+                exp_len.append(len(tokens))
+                exp_tokens += tokens
+        self.exp_tokens = np.array(exp_tokens, dtype=np.int32)
+        self.exp_start = np.array(exp_start, dtype=np.int64)
+        self.exp_len = np.array(exp_len, dtype=np.int64)
+
+        # Choice tables: phase x symbol id -> expansions to choose from
+        choices = []
+        choice_start = np.zeros((3, max(n, 1)), dtype=np.int64)
+        choice_count = np.ones((3, max(n, 1)), dtype=np.int64)
+        for phase in (self.MAX_COST, self.RANDOM, self.MIN_COST):
+            for sid in range(n):
+                indexes = range(len(compiled.expansions[sid]))
+                if phase != self.RANDOM:
+                    symbol = compiled.symbols[sid]
+                    costs = compiled.expansion_costs(
+                        symbol, maximize=phase == self.MAX_COST)
+                    chosen_cost = (max if phase == self.MAX_COST else min)(costs)
+                    indexes = [i for i in indexes if costs[i] == chosen_cost]
+                choice_start[phase, sid] = len(choices)
+                choice_count[phase, sid] = len(indexes)
+                choices += [first[sid] + i for i in indexes]
+        self.choices = np.array(choices, dtype=np.int64)
+        self.choice_start = choice_start
+        self.choice_count = choice_count
+
+        # Terminal strings, as one blob of UTF-8 bytes
+        blob = []
+        sym_start = []
+        sym_len = []
+        offset = 0
+        for sid, symbol in enumerate(compiled.symbols):
+            data = b"" if sid < n else symbol.encode('utf-8')
+            blob.append(data)
+            sym_start.append(offset)
+            sym_len.append(len(data))
+            offset += len(data)
+        self.blob = np.frombuffer(b"".join(blob), dtype=np.uint8)
+        self.sym_start = np.array(sym_start, dtype=np.int64)
+        self.sym_len = np.array(sym_len, dtype=np.int64)
+        self.ascii = all(symbol.isascii() for symbol in compiled.symbols)
+
+    def expand(self, start_symbol, n, min_nonterminals=0, max_nonterminals=10, rng=None):
+        """Derive `n` strings from `start_symbol`.  Return the derivation
+        trees level by level, as a list of `(symbols, parents)` arrays:
+        the children of a node are consecutive in the next level, and
+        `parents` holds the index of each node's parent in the level above."""
+        if rng is None:
+            rng = np.random.default_rng(random.getrandbits(64))
+        n_nonterminals = self.compiled.n_nonterminals
+
+        syms = np.full(n, self.compiled.ids[start_symbol], dtype=np.int32)
+        levels = [(syms, None)]
+        # The open nonterminals: index in the last level, and derivation
+        open_positions = np.arange(n, dtype=np.int64)
+        owner = open_positions
+        phase = np.zeros(n, dtype=np.int64)
+        while len(open_positions) > 0:
+            # Move on to the next phase once a limit is reached
+            counts = np.bincount(owner, minlength=n)
+            wanted = np.where(counts < min_nonterminals, self.MAX_COST,
+                              np.where(counts < max_nonterminals, self.RANDOM, self.MIN_COST))
+            if len(levels) > self.MAX_ROUNDS:
+                wanted[:] = self.MIN_COST
+            np.maximum(phase, wanted, out=phase)
+
+            # Draw expansions for all open nonterminals at once
+            open_syms = syms[open_positions]
+            open_phase = phase[owner]
+            count = self.choice_count[open_phase, open_syms]
+            picks = (rng.random(len(open_positions)) * count).astype(np.int64)
+            exps = self.choices[self.choice_start[open_phase, open_syms] + picks]
+
+            # Their children form the next level
+            exp_len = self.exp_len[exps]
+            within = np.arange(exp_len.sum()) - np.repeat(np.cumsum(exp_len) - exp_len, exp_len)
+            syms = self.exp_tokens[np.repeat(self.exp_start[exps], exp_len) + within]
+            parents = np.repeat(open_positions, exp_len)
+            levels.append((syms, parents))
+
+            is_open = syms < n_nonterminals
+            open_positions = np.flatnonzero(is_open)
+            owner = np.repeat(owner, exp_len)[is_open]
+
+        return levels
+
+    def strings(self, levels, n):
+        """Return the strings derived in `levels`, as returned by `expand()`"""
+        # Bottom up: the number of bytes derived from each node
+        sizes = [None] * len(levels)
+        below = None
+        for depth in range(len(levels) - 1, -1, -1):
+            syms, parents = levels[depth]
+            size = self.sym_len[syms]
+            if below is not None:
+                size = size + np.bincount(levels[depth + 1][1], weights=below,
+                                          minlength=len(syms)).astype(np.int64)
+            sizes[depth] = below = size
+
+        # Top down: where each node starts in the output
+        starts = [np.cumsum(sizes[0]) - sizes[0]]
+        for depth in range(1, len(levels)):
+            parents = levels[depth][1]
+            size = sizes[depth]
+            before = np.cumsum(size) - size
+            # Children are consecutive, so the first child of a parent is
+            # where `parents` changes
+            first = np.flatnonzero(np.r_[True, parents[1:] != parents[:-1]])
+            group = np.repeat(first, np.diff(np.r_[first, len(parents)]))
+            starts.append(starts[depth - 1][parents] + before - before[group])
+
+        # Copy the bytes of all terminals into place
+        total = int(sizes[0].sum())
+        data = np.empty(total, dtype=np.uint8)
+        for depth in range(len(levels)):
+            syms = levels[depth][0]
+            lengths = self.sym_len[syms]
+            leaves = np.flatnonzero(lengths)
+            lengths = lengths[leaves]
+            within = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+            data[np.repeat(starts[depth][leaves], lengths) + within] = \
+                self.blob[np.repeat(self.sym_start[syms[leaves]], lengths) + within]
+        data = data.tobytes()
+
+        ends = np.cumsum(sizes[0]).tolist()
+        starts = [0] + ends[:-1]
+        if self.ascii:
+            text = data.decode('ascii')
+            return [text[start:end] for (start, end) in zip(starts, ends)]
+        return [data[start:end].decode('utf-8') for (start, end) in zip(starts, ends)]
+
+
 class GrammarFuzzer(Fuzzer):
     def __init__(self, grammar, start_symbol=START_SYMBOL,
                  min_nonterminals=0, max_nonterminals=10, disp=False, log=False):
@@ -198,6 +421,23 @@ class GrammarFuzzer(Fuzzer):
         self.disp = disp
         self.log = log
         self.check_grammar()
+        self.compiled = compile_grammar(self.grammar)
+
+        # Without a custom `choose_node_expansion()`, we only need to build
+        # the children of the expansion actually chosen
+        self._default_node_choice = (type(self).choose_node_expansion
+                                     is GrammarFuzzer.choose_node_expansion)
+        # Likewise, without a custom `choose_tree_expansion()`, we can pick
+        # open nodes from an `ExpansionFrontier` instead of walking the tree
+        self._default_tree_choice = (type(self).choose_tree_expansion
+                                     is GrammarFuzzer.choose_tree_expansion)
+        # If expansions are not customized, nodes can be closed with one of
+        # the minimum-cost trees precomputed for the grammar
+        self._precomputed_min_cost = (
+            self._default_node_choice and
+            type(self).expansion_to_children is GrammarFuzzer.expansion_to_children and
+            type(self).process_chosen_children is GrammarFuzzer.process_chosen_children)
+        self._batch_expander = None  # Built on first `fuzz_batch()`
 
     def check_grammar(self):
         assert self.start_symbol in self.grammar
@@ -215,6 +455,11 @@ class GrammarFuzzer(Fuzzer):
     def expansion_to_children(self,expansion):
         '''字符串包含所有子字符串——包括终端字符串和非终端字符串，例如" .join(strings) ==展开'''
 
+        children = self.compiled.expansion_to_children(expansion)
+        if children is not None:
+            return children
+
+        # Not part of the grammar: split it
         expansion = exp_string(expansion)
         assert isinstance(expansion, str)
 
@@ -254,11 +499,15 @@ class GrammarFuzzer(Fuzzer):
 
     def possible_expansions(self, node):
         '''获取待扩充的非终端节点数'''
-        (symbol, children) = node
-        if children is None:
-            return 1
-
-        return sum(self.possible_expansions(c) for c in children)
+        count = 0
+        stack = [node]
+        while stack:
+            children = stack.pop()[1]
+            if children is None:
+                count += 1
+            else:
+                stack.extend(children)
+        return count
 
 
 # if __name__ == "__main__":
@@ -274,11 +523,13 @@ class GrammarFuzzer(Fuzzer):
 
     def any_possible_expansions(self, node):
         '''判断是否有非终端节点'''
-        (symbol, children) = node
-        if children is None:
-            return True
-
-        return any(self.any_possible_expansions(c) for c in children)
+        stack = [node]
+        while stack:
+            children = stack.pop()[1]
+            if children is None:
+                return True
+            stack.extend(children)
+        return False
 
     def choose_tree_expansion(self, tree, children):
         """返回要选择进行展开的“children”中的子树索引。默认：随机。"""
@@ -291,33 +542,44 @@ class GrammarFuzzer(Fuzzer):
             # Expand this node
             return self.expand_node(tree)
 
-        # Find all children with possible expansions
-        expandable_children = [
-            c for c in children if self.any_possible_expansions(c)]
-
-        # `index_map` translates an index in `expandable_children`
-        # back into the original index in `children`
-        index_map = [i for (i, c) in enumerate(children)
-                     if c in expandable_children]
+        node = tree
+        while True:
+            children = node[1]
 
-        # Select a random child
-        child_to_be_expanded = \
-            self.choose_tree_expansion(tree, expandable_children)
+            # Find all children with possible expansions;
+            # `index_map` translates an index in `expandable_children`
+            # back into the original index in `children`
+            index_map = [i for (i, c) in enumerate(children)
+                         if self.any_possible_expansions(c)]
+            expandable_children = [children[i] for i in index_map]
 
-        # Expand in place
-        children[index_map[child_to_be_expanded]] = \
-            self.expand_tree_once(expandable_children[child_to_be_expanded])
+            # Select a random child
+            child_to_be_expanded = \
+                self.choose_tree_expansion(node, expandable_children)
+            index = index_map[child_to_be_expanded]
 
-        return tree
+            child = children[index]
+            if child[1] is None:
+                # Expand in place
+                children[index] = self.expand_node(child)
+                return tree
+            node = child
 
 
     def symbol_cost(self, symbol, seen=set()):
-        expansions = self.grammar[symbol]
-        return min(self.expansion_cost(e, seen | {symbol}) for e in expansions)
+        """Return the minimum number of expansions to derive a string from
+        `symbol` without expanding any of the symbols in `seen` below it.
+        This is looked up in cost tables computed once per grammar, and once
+        per `seen` set."""
+        if seen <= {symbol}:
+            # A cheapest derivation never expands `symbol` below itself
+            return self.compiled.symbol_cost(symbol)
+        return min(self.expansion_cost(expansion, seen | {symbol})
+                   for expansion in self.grammar[symbol])
 
     def expansion_cost(self, expansion, seen=set()):
         '''计算扩充成本，即最小扩充数'''
-        symbols = nonterminals(expansion)
+        symbols = self.compiled.nonterminals(expansion)
         if len(symbols) == 0:
             return 1  # no symbol
 
@@ -325,8 +587,12 @@ class GrammarFuzzer(Fuzzer):
             return float('inf')
 
         # the value of a expansion is the sum of all expandable variables
-        # inside + 1
-        return sum(self.symbol_cost(s, seen) for s in symbols) + 1
+        # inside + 1.  A cheapest derivation never repeats a symbol below
+        # itself, so avoiding `seen` is all that matters.
+        if not seen:
+            return sum(self.compiled.symbol_cost(s) for s in symbols) + 1
+        costs = self.compiled.costs_avoiding(seen)
+        return sum(costs[self.compiled.ids[s]] for s in symbols) + 1
 
 
     def expand_node_by_cost(self, node, choose=min):
@@ -336,26 +602,26 @@ class GrammarFuzzer(Fuzzer):
         # Fetch the possible expansions from grammar...
         expansions = self.grammar[symbol]
 
-        possible_children_with_cost = [(self.expansion_to_children(expansion),
-                                        self.expansion_cost(
-                                            expansion, {symbol}),
-                                        expansion)
-                                       for expansion in expansions]
-
-        costs = [cost for (child, cost, expansion)
-                 in possible_children_with_cost]
+        # Maximizing prefers expansions that recurse; see
+        # `CompiledGrammar.expansion_costs()`
+        costs = self.compiled.expansion_costs(symbol, maximize=choose is max)
         chosen_cost = choose(costs)
-        children_with_chosen_cost = [child for (child, child_cost, _) in possible_children_with_cost
-                                     if child_cost == chosen_cost]
-        expansion_with_chosen_cost = [expansion for (_, child_cost, expansion) in possible_children_with_cost
-                                      if child_cost == chosen_cost]
+        indexes_with_chosen_cost = [i for (i, cost) in enumerate(costs)
+                                    if cost == chosen_cost]
 
-        index = self.choose_node_expansion(node, children_with_chosen_cost)
+        if self._default_node_choice:
+            index = indexes_with_chosen_cost[
+                random.randrange(0, len(indexes_with_chosen_cost))]
+            chosen_children = self.expansion_to_children(expansions[index])
+        else:
+            children_with_chosen_cost = [self.expansion_to_children(expansions[i])
+                                         for i in indexes_with_chosen_cost]
+            chosen = self.choose_node_expansion(node, children_with_chosen_cost)
+            index = indexes_with_chosen_cost[chosen]
+            chosen_children = children_with_chosen_cost[chosen]
 
-        chosen_children = children_with_chosen_cost[index]
-        chosen_expansion = expansion_with_chosen_cost[index]
         chosen_children = self.process_chosen_children(
-            chosen_children, chosen_expansion)
+            chosen_children, expansions[index])
 
         # 返回一个新list
         return (symbol, chosen_children)
@@ -366,6 +632,11 @@ class GrammarFuzzer(Fuzzer):
         if self.log:
             print("Expanding", all_terminals(node), "at minimum cost")
 
+        if self._precomputed_min_cost:
+            tree = self.compiled.min_cost_completion(node[0])
+            if tree is not None:
+                return tree
+
         return self.expand_node_by_cost(node, min)
 
     def expand_node_max_cost(self, node):
@@ -385,12 +656,16 @@ class GrammarFuzzer(Fuzzer):
 
         # Fetch the possible expansions from grammar...
         expansions = self.grammar[symbol]
-        possible_children = [self.expansion_to_children(
-            expansion) for expansion in expansions]
+        if self._default_node_choice:
+            index = random.randrange(0, len(expansions))
+            chosen_children = self.expansion_to_children(expansions[index])
+        else:
+            possible_children = [self.expansion_to_children(
+                expansion) for expansion in expansions]
 
-        # ... and select a random expansion
-        index = self.choose_node_expansion(node, possible_children)
-        chosen_children = possible_children[index]
+            # ... and select a random expansion
+            index = self.choose_node_expansion(node, possible_children)
+            chosen_children = possible_children[index]
 
         # Process children (for subclasses)
         chosen_children = self.process_chosen_children(chosen_children,
@@ -412,6 +687,13 @@ class GrammarFuzzer(Fuzzer):
 
     def expand_tree_with_strategy(self, tree, expand_node_method, limit=None):
         """使用' expand_node_method '作为节点扩展函数展开树，直到可能展开的次数达到“limit”为止。"""
+        if self._default_tree_choice:
+            frontier = ExpansionFrontier(tree)
+            self.expand_frontier(frontier, expand_node_method, limit)
+            return frontier.tree()
+
+        # A custom `choose_tree_expansion()` chooses among the children
+        # at each level, so walk the tree
         self.expand_node = expand_node_method
         while ((limit is None
                 or self.possible_expansions(tree) < limit)
@@ -420,6 +702,18 @@ class GrammarFuzzer(Fuzzer):
             self.log_tree(tree)
         return tree
 
+    def expand_frontier(self, frontier, expand_node_method, limit=None):
+        """Expand random open nodes of `frontier` with `expand_node_method`
+        until the number of open nodes reaches `limit`."""
+        self.expand_node = expand_node_method
+        slots = frontier.slots
+        while slots and (limit is None or len(slots) < limit):
+            children, index = frontier.pop(random.randrange(0, len(slots)))
+            children[index] = self.expand_node(children[index])
+            frontier.add(children, index)
+            if self.log:
+                self.log_tree(frontier.tree())
+
 
     def expand_tree(self, tree):
         """在三个阶段策略中展开“tree”，直到完成所有扩展内容。"""
@@ -452,6 +746,27 @@ class GrammarFuzzer(Fuzzer):
         self.derivation_tree = self.fuzz_tree()
         return all_terminals(self.derivation_tree)
 
+    def fuzz_batch(self, n):
+        """Return a list of `n` inputs.  With NumPy, and unless expansion is
+        customized, all `n` are derived at once by a `BatchExpander`;
+        `derivation_tree` is not set then."""
+        if np is None or self.log or self.disp or not self._precomputed_min_cost \
+                or not self._default_tree_choice:
+            return super().fuzz_batch(n)
+        for name in ("fuzz", "fuzz_tree", "init_tree", "expand_tree",
+                     "expand_tree_with_strategy", "expand_frontier",
+                     "expand_node_randomly", "expand_node_by_cost",
+                     "expand_node_min_cost", "expand_node_max_cost"):
+            if getattr(type(self), name) is not getattr(GrammarFuzzer, name):
+                return super().fuzz_batch(n)
+
+        if self._batch_expander is None:
+            self._batch_expander = BatchExpander(self.compiled)
+        expander = self._batch_expander
+        levels = expander.expand(self.start_symbol, n,
+                                 self.min_nonterminals, self.max_nonterminals)
+        return expander.strings(levels, n)
+
 
 if __name__ == "__main__":
     '''使用GrammarFuzzer 模糊生成算数表达式'''
@@ -468,16 +783,28 @@ class FasterGrammarFuzzer(GrammarFuzzer):
         self._expansion_invocations = 0
         self._expansion_invocations_cached = 0
 
+        # Our `expansion_to_children()` only adds caching
+        self._precomputed_min_cost = (
+            self._default_node_choice and
+            type(self).expansion_to_children is FasterGrammarFuzzer.expansion_to_children and
+            type(self).process_chosen_children is GrammarFuzzer.process_chosen_children)
+
     def expansion_to_children(self, expansion):
+        """Like `GrammarFuzzer.expansion_to_children()`, but caching the
+        children as immutable `(symbol, is_nonterminal)` templates.  The tree
+        is expanded in place, so every call builds fresh nodes."""
         self._expansion_invocations += 1
-        if expansion in self._expansion_cache:
+        key = exp_string(expansion)
+        template = self._expansion_cache.get(key)
+        if template is not None:
             self._expansion_invocations_cached += 1
-            cached_result = copy.deepcopy(self._expansion_cache[expansion])
-            return cached_result
+        else:
+            template = tuple((symbol, children is None) for (symbol, children)
+                             in super().expansion_to_children(expansion))
+            self._expansion_cache[key] = template
 
-        result = super().expansion_to_children(expansion)
-        self._expansion_cache[expansion] = result
-        return result
+        return [(symbol, None) if nonterminal else (symbol, [])
+                for (symbol, nonterminal) in template]
 
 if __name__ == "__main__":
     f = FasterGrammarFuzzer(EXPR_GRAMMAR, min_nonterminals=3, max_nonterminals=5)
@@ -497,14 +824,14 @@ class EvenFasterGrammarFuzzer(GrammarFuzzer):
         return self._symbol_costs[symbol]
 
     def new_expansion_cost(self, expansion, seen=set()):
-        return self._expansion_costs[expansion]
+        return self._expansion_costs[exp_string(expansion)]
 
     def precompute_costs(self):
         for symbol in self.grammar:
-            self._symbol_costs[symbol] = super().symbol_cost(symbol)
-            for expansion in self.grammar[symbol]:
-                self._expansion_costs[expansion] = super(
-                ).expansion_cost(expansion)
+            self._symbol_costs[symbol] = self.compiled.symbol_cost(symbol)
+            costs = self.compiled.expansion_costs(symbol)
+            for expansion, cost in zip(self.grammar[symbol], costs):
+                self._expansion_costs[exp_string(expansion)] = cost
 
         # Make sure we now call the caching methods
         self.symbol_cost = self.new_symbol_cost
@@ -512,3 +839,74 @@ class EvenFasterGrammarFuzzer(GrammarFuzzer):
 
 
 
+
+
+if __name__ == "__main__":
+    '''验证深度派生树：100000 层，无需调整递归深度限制'''
+    from nfuzz.Grammars import CGI_GRAMMAR
+    depth = 100000
+    f = EvenFasterGrammarFuzzer(CGI_GRAMMAR)
+    tree = ("<string>", [("<letter>", None), ("<string>", None)])
+    for i in range(depth - 1):
+        tree = ("<string>", [("<letter>", None), tree])
+    tree = ("<start>", [tree])
+    assert f.possible_expansions(tree) == depth + 1
+    tree = f.expand_tree(tree)
+    assert not f.any_possible_expansions(tree)
+    assert len(tree_to_string(tree)) >= depth
+    assert all_terminals(tree) == tree_to_string(tree)
+
+
+if __name__ == "__main__":
+    '''对比 GrammarFuzzer / FasterGrammarFuzzer / EvenFasterGrammarFuzzer 的生成速度。
+    GrammarFuzzer 本身已使用编译后的文法与代价表，两个子类不再更快，
+    这里只报告相对速度与缓存命中次数，不保证三者的快慢顺序。'''
+    import time
+    from nfuzz.Grammars import URL_GRAMMAR, CGI_GRAMMAR
+
+    trials = 2000
+    repeats = 3
+    for name, grammar in [("EXPR_GRAMMAR", EXPR_GRAMMAR),
+                          ("URL_GRAMMAR", URL_GRAMMAR),
+                          ("CGI_GRAMMAR", CGI_GRAMMAR)]:
+        print(name)
+        base_elapsed = None
+        for fuzzer_class in [GrammarFuzzer, FasterGrammarFuzzer,
+                             EvenFasterGrammarFuzzer]:
+            # Best of `repeats`, each on the same inputs
+            elapsed = float('inf')
+            for r in range(repeats):
+                random.seed(0)
+                start_time = time.time()
+                f = fuzzer_class(grammar, min_nonterminals=5, max_nonterminals=50)
+                for i in range(trials):
+                    f.fuzz()
+                elapsed = min(elapsed, time.time() - start_time)
+            if base_elapsed is None:
+                base_elapsed = elapsed
+            line = "  %-24s %8.0f inputs/s  %5.2fx" % (
+                fuzzer_class.__name__, trials / elapsed, base_elapsed / elapsed)
+            if isinstance(f, FasterGrammarFuzzer):
+                line += "  (%d of %d expansions cached)" % (
+                    f._expansion_invocations_cached, f._expansion_invocations)
+            print(line)
+
+
+if __name__ == "__main__":
+    '''对比 fuzz() 与 fuzz_batch() 的生成速度 (需要 NumPy)'''
+    import time
+
+    trials = 2000
+    batch = 50000
+    f = GrammarFuzzer(EXPR_GRAMMAR)
+    start_time = time.time()
+    for i in range(trials):
+        f.fuzz()
+    single = trials / (time.time() - start_time)
+
+    start_time = time.time()
+    inputs = f.fuzz_batch(batch)
+    batched = batch / (time.time() - start_time)
+    print("EXPR_GRAMMAR fuzz(): %8.0f inputs/s, fuzz_batch(): %8.0f inputs/s (%s)" %
+          (single, batched, "NumPy" if np is not None else "no NumPy"))
+    print(inputs[:3])
@@ -31,6 +31,9 @@ import random
 import string
 import copy
 import sys
+import hashlib
+import heapq
+import itertools
 
 if __package__ is None or __package__ == "":
     pass
@@ -438,17 +441,15 @@ def unreachable_nonterminals(grammar, start_symbol=START_SYMBOL):
 
 
 def reachable_nonterminals(grammar, start_symbol=START_SYMBOL):
-    reachable = set()
-
-    def _find_reachable_nonterminals(grammar, symbol):
-        nonlocal reachable
-        reachable.add(symbol)
+    reachable = {start_symbol}
+    stack = [start_symbol]
+    while stack:
+        symbol = stack.pop()
         for expansion in grammar.get(symbol, []):
             for nonterminal in nonterminals(expansion):
                 if nonterminal not in reachable:
-                    _find_reachable_nonterminals(grammar, nonterminal)
-
-    _find_reachable_nonterminals(grammar, start_symbol)
+                    reachable.add(nonterminal)
+                    stack.append(nonterminal)
     return reachable
 
 def opts_used(grammar):
@@ -472,3 +473,364 @@ def exp_string(expansion):
     if isinstance(expansion, str):
         return expansion
     return expansion[0]
+
+
+
+class CompiledGrammar(object):
+    """A grammar compiled into an integer form for fast generation.
+
+    All symbols are interned: nonterminals get the ids `0 .. n_nonterminals - 1`
+    (in grammar order), terminals the ids after that.  Each expansion is
+    tokenized once into a tuple of symbol ids."""
+
+    def __init__(self, grammar):
+        self.grammar = grammar
+        self.symbols = []  # symbol id -> symbol
+        self.ids = {}  # symbol -> symbol id
+
+        splits = {}
+        for symbol in grammar:
+            self._intern(symbol)
+        for symbol in grammar:
+            for expansion in grammar[symbol]:
+                string = exp_string(expansion)
+                if string not in splits:
+                    splits[string] = [s for s in re.split(RE_NONTERMINAL, string)
+                                      if len(s) > 0] or [""]
+                    for s in splits[string]:
+                        if is_nonterminal(s):
+                            # Intern nonterminals first, so that
+                            # `id < n_nonterminals` tells them from terminals
+                            self._intern(s)
+        self.n_nonterminals = len(self.symbols)
+
+        self.tokens = {}  # expansion string -> tuple of symbol ids
+        for string in splits:
+            self.tokens[string] = tuple(self._intern(s) for s in splits[string])
+
+        self.expansions = []  # symbol id -> tuple of token tuples
+        for symbol in self.symbols[:self.n_nonterminals]:
+            expansions = grammar.get(symbol, [])  # Used, but not defined
+            self.expansions.append(tuple(self.tokens[exp_string(expansion)]
+                                         for expansion in expansions))
+
+        # Computed on first use
+        self._symbol_costs = None
+        self._expansion_costs = None
+        self._max_expansion_costs = None
+        self._dependents = None
+        self._completions = None
+
+    def _intern(self, symbol):
+        sid = self.ids.get(symbol)
+        if sid is None:
+            sid = len(self.symbols)
+            self.ids[symbol] = sid
+            self.symbols.append(symbol)
+        return sid
+
+    def is_nonterminal(self, sid):
+        return sid < self.n_nonterminals
+
+    def expansion_to_children(self, expansion):
+        """Return fresh derivation tree children for `expansion`, or None if
+        `expansion` does not occur in the grammar"""
+        tokens = self.tokens.get(exp_string(expansion))
+        if tokens is None:
+            return None
+        symbols = self.symbols
+        n = self.n_nonterminals
+        return [(symbols[t], None) if t < n else (symbols[t], [])
+                for t in tokens]
+
+    def nonterminals(self, expansion):
+        """Like `nonterminals()`, but without regex matching for known expansions"""
+        tokens = self.tokens.get(exp_string(expansion))
+        if tokens is None:
+            return nonterminals(expansion)
+        return [self.symbols[t] for t in tokens if t < self.n_nonterminals]
+
+    def symbol_cost(self, symbol):
+        """Return the minimum number of expansions needed to derive a
+        string from `symbol`; `inf` if there is no such derivation"""
+        if self._symbol_costs is None:
+            self.compute_costs()
+        return self._symbol_costs[self.ids[symbol]]
+
+    def expansion_costs(self, symbol, maximize=False):
+        """Return the minimum costs of the expansions of `symbol`, in grammar
+        order.  If `maximize` is set, return the costs of completing each
+        expansion without deriving `symbol` again instead: `inf` for
+        expansions that must recurse, the maximum finite costs otherwise."""
+        if self._symbol_costs is None:
+            self.compute_costs()
+        sid = self.ids[symbol]
+        if not maximize:
+            return self._expansion_costs[sid]
+
+        costs = self._max_expansion_costs[sid]
+        if costs is None:
+            costs = self._max_expansion_costs[sid] = self._costs_avoiding(sid)
+        return costs
+
+    def compute_costs(self):
+        """Compute the minimum cost tables, in polynomial time"""
+        n = self.n_nonterminals
+        expansions = self.expansions
+        costs = self._least_costs(range(n), lambda t: None)
+
+        self._symbol_costs = costs
+        self._expansion_costs = [
+            tuple(1 + sum(costs[t] for t in tokens if t < n)
+                  for tokens in expansions[sid])
+            for sid in range(n)]
+
+        # Costs for maximizing are computed per symbol, on first use.
+        # `_dependents[A]` lists the symbols whose cheapest expansion uses A.
+        self._dependents = [[] for sid in range(n)]
+        for sid in range(n):
+            expansion_costs = self._expansion_costs[sid]
+            if len(expansion_costs) == 0 or costs[sid] == float('inf'):
+                continue
+            cheapest = expansions[sid][expansion_costs.index(costs[sid])]
+            for t in set(cheapest):
+                if t < n:
+                    self._dependents[t].append(sid)
+        self._max_expansion_costs = [None] * n
+        self._avoiding_costs = {}  # frozenset of symbols -> costs
+
+    def _least_costs(self, symbols, fixed_cost):
+        """Return the least fixed point of
+        cost(A) = min over A -> e of (1 + sum of cost(B) for B in e)
+        for all A in `symbols`, as a list indexed by symbol id.
+        `fixed_cost(B)` returns the cost of B if it is given, and None if it
+        is to be computed.  The worklist is processed in order of increasing
+        cost (Knuth's generalization of Dijkstra), so that every symbol is
+        finished once."""
+        inf = float('inf')
+        n = self.n_nonterminals
+        costs = [inf] * n
+        remaining = {}  # (symbol, expansion) -> number of open nonterminals
+        partial = {}  # (symbol, expansion) -> sum of costs so far, plus 1
+        uses = {}  # symbol -> (symbol, expansion) using it
+        heap = []
+
+        for sid in symbols:
+            for i, tokens in enumerate(self.expansions[sid]):
+                cost = 1
+                open_tokens = []
+                for t in tokens:
+                    if t >= n:
+                        continue
+                    t_cost = fixed_cost(t)
+                    if t_cost is None:
+                        open_tokens.append(t)
+                    else:
+                        cost += t_cost
+                if cost == inf:
+                    continue
+                remaining[sid, i] = len(open_tokens)
+                partial[sid, i] = cost
+                for t in open_tokens:
+                    uses.setdefault(t, []).append((sid, i))
+                if len(open_tokens) == 0:
+                    heapq.heappush(heap, (cost, sid))
+
+        done = set()
+        while heap:
+            cost, sid = heapq.heappop(heap)
+            if sid in done:
+                continue
+            done.add(sid)
+            costs[sid] = cost
+            for (user, i) in uses.get(sid, []):
+                partial[user, i] += cost
+                remaining[user, i] -= 1
+                if remaining[user, i] == 0 and user not in done:
+                    heapq.heappush(heap, (partial[user, i], user))
+
+        return costs
+
+    def _costs_avoiding(self, sid):
+        """Return the costs of the expansions of `sid` in the grammar without
+        `sid`"""
+        n = self.n_nonterminals
+        costs = self._symbol_costs_avoiding({sid})
+        return tuple(1 + sum(costs[t] for t in tokens if t < n)
+                     for tokens in self.expansions[sid])
+
+    def _symbol_costs_avoiding(self, sids):
+        """Return the costs of all nonterminals in the grammar without the
+        nonterminals `sids` (`inf` for these).  Only symbols whose cheapest
+        derivation uses one of `sids` change their costs, so only these are
+        computed again."""
+        inf = float('inf')
+        n = self.n_nonterminals
+        costs = self._symbol_costs
+
+        affected = set()
+        stack = list(sids)
+        while stack:
+            for t in self._dependents[stack.pop()]:
+                if t not in sids and t not in affected:
+                    affected.add(t)
+                    stack.append(t)
+
+        def fixed_cost(t):
+            if t in sids:
+                return inf
+            if t in affected:
+                return None
+            return costs[t]
+
+        local_costs = self._least_costs(affected, fixed_cost)
+        return [local_costs[t] if t in affected else fixed_cost(t)
+                for t in range(n)]
+
+    def costs_avoiding(self, symbols):
+        """Return the minimum costs of all nonterminals, by id, in the grammar
+        without the nonterminals `symbols`; `inf` for these.  Results are
+        cached per set of symbols."""
+        if self._symbol_costs is None:
+            self.compute_costs()
+        key = frozenset(symbols)
+        costs = self._avoiding_costs.get(key)
+        if costs is None:
+            if len(self._avoiding_costs) >= MAX_AVOIDING_COSTS:
+                self._avoiding_costs.clear()
+            sids = {self.ids[symbol] for symbol in key if symbol in self.ids}
+            sids = {sid for sid in sids if sid < self.n_nonterminals}
+            costs = self._avoiding_costs[key] = self._symbol_costs_avoiding(sids)
+        return costs
+
+    def min_cost_completion(self, symbol):
+        """Return a fresh derivation tree that completes `symbol` at minimum
+        cost.  Trees are drawn with the same probabilities as when expanding
+        node by node at minimum cost.  Return None if `symbol` has more than
+        `MAX_MIN_COST_COMPLETIONS` such trees."""
+        completions = self.min_cost_completions(symbol)
+        if completions is None:
+            return None
+
+        templates, cum_weights = completions
+        if len(templates) == 1:
+            template = templates[0]
+        elif cum_weights is None:
+            template = templates[random.randrange(0, len(templates))]
+        else:
+            template = random.choices(templates, cum_weights=cum_weights)[0]
+        return instantiate_template(template)
+
+    def min_cost_completions(self, symbol):
+        """Return `(templates, cum_weights)` for the minimum-cost trees of
+        `symbol`, with `cum_weights` None if all are equally likely; or None
+        if there are too many"""
+        if self._completions is None:
+            self.compute_completions()
+        return self._completions[self.ids[symbol]]
+
+    def compute_completions(self):
+        """Enumerate the minimum-cost derivation trees of all symbols, as
+        `(symbol, children)` templates with tuples as children"""
+        if self._symbol_costs is None:
+            self.compute_costs()
+        n = self.n_nonterminals
+        costs = self._symbol_costs
+        completions = [None] * n  # symbol -> list of (template, probability)
+
+        # Children of minimum-cost trees have lower costs than their parents
+        for sid in sorted(range(n), key=lambda sid: costs[sid]):
+            if costs[sid] == float('inf'):
+                continue
+            chosen = [i for (i, cost) in enumerate(self._expansion_costs[sid])
+                      if cost == costs[sid]]
+            options = []
+            for i in chosen:
+                partial = [((), 1.0 / len(chosen))]
+                for t in self.expansions[sid][i]:
+                    if t >= n:
+                        leaf = (self.symbols[t], ())
+                        partial = [(children + (leaf,), p)
+                                   for (children, p) in partial]
+                        continue
+                    if completions[t] is None or \
+                            len(partial) * len(completions[t]) > MAX_MIN_COST_COMPLETIONS:
+                        partial = None
+                        break
+                    partial = [(children + (template,), p * q)
+                               for (children, p) in partial
+                               for (template, q) in completions[t]]
+                if partial is None:
+                    options = None
+                    break
+                options += [((self.symbols[sid], children), p)
+                            for (children, p) in partial]
+                if len(options) > MAX_MIN_COST_COMPLETIONS:
+                    options = None
+                    break
+            completions[sid] = options
+
+        self._completions = [None] * n
+        for sid in range(n):
+            if completions[sid] is None:
+                continue
+            templates = [template for (template, p) in completions[sid]]
+            probabilities = [p for (template, p) in completions[sid]]
+            cum_weights = None
+            if max(probabilities) != min(probabilities):
+                cum_weights = list(itertools.accumulate(probabilities))
+            self._completions[sid] = (templates, cum_weights)
+
+
+MAX_MIN_COST_COMPLETIONS = 100
+MAX_AVOIDING_COSTS = 1024  # Cached `CompiledGrammar.costs_avoiding()` results
+
+
+def instantiate_template(template):
+    """Turn a `(symbol, children)` template with tuples as children into a
+    fresh derivation tree"""
+    symbol, templates = template
+    if not templates:
+        return (symbol, [])
+
+    root = (symbol, [])
+    stack = [(templates, root[1])]
+    while stack:
+        templates, children = stack.pop()
+        for (symbol, sub_templates) in templates:
+            if sub_templates:
+                node = (symbol, [])
+                stack.append((sub_templates, node[1]))
+            else:
+                node = (symbol, [])
+            children.append(node)
+    return root
+
+
+def grammar_hash(grammar):
+    """Return a hash of `grammar` that is stable across runs"""
+    digest = hashlib.sha256()
+    for symbol in grammar:
+        digest.update(repr(symbol).encode('utf-8'))
+        for expansion in grammar[symbol]:
+            digest.update(b'\0')
+            digest.update(repr(exp_string(expansion)).encode('utf-8'))
+            digest.update(repr(sorted(exp_opts(expansion).items())).encode('utf-8'))
+        digest.update(b'\1')
+    return digest.hexdigest()
+
+
+_compiled_grammars = {}
+MAX_COMPILED_GRAMMARS = 32
+
+
+def compile_grammar(grammar):
+    """Return the `CompiledGrammar` for `grammar`, shared among all equal grammars"""
+    key = grammar_hash(grammar)
+    compiled = _compiled_grammars.get(key)
+    if compiled is None:
+        if len(_compiled_grammars) >= MAX_COMPILED_GRAMMARS:
+            _compiled_grammars.pop(next(iter(_compiled_grammars)))
+        compiled = CompiledGrammar(grammar)
+        _compiled_grammars[key] = compiled
+    return compiled
@@ -28,6 +28,8 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 '''
 import random
+import struct
+import time
 try:
     from urlparse import urlparse  # Python 2
 except ImportError:
@@ -48,6 +50,16 @@ try:
 except ImportError:
     from .Fuzzer import Runner
 
+try:
+    from nfuzz.Coverage import Coverage, EdgeCoverage
+except ImportError:
+    from .Coverage import Coverage, EdgeCoverage
+
+try:
+    from nfuzz.Crashes import CrashBuckets, exception_signature
+except ImportError:
+    from .Crashes import CrashBuckets, exception_signature
+
 
 
 #执行http请求相关内容
@@ -114,36 +126,228 @@ def flip_random_character(s):
     # print("Flipping", bit, "in", repr(c) + ", giving", repr(new_c))
     return s[:pos] + new_c + s[pos + 1:]
 
+MUTATORS = [
+    delete_random_character,
+    insert_random_character,
+    flip_random_character
+]
+
+
 #随机处理字符串
 def mutate(s):
     """Return s with a random mutation applied"""
-    mutators = [
-        delete_random_character,
-        insert_random_character,
-        flip_random_character
-    ]
-    mutator = random.choice(mutators)
+    mutator = random.choice(MUTATORS)
     # print(mutator)
     return mutator(s)
 
 
+# 字节级原地变异 (AFL havoc 风格)，直接修改 bytearray，不重新拼接整个输入
+
+'''AFL 的 "interesting" 取值'''
+INTERESTING_8 = [-128, -1, 0, 1, 16, 32, 64, 100, 127]
+INTERESTING_16 = INTERESTING_8 + [-32768, -129, 128, 255, 256, 512, 1000, 1024, 4096, 32767]
+INTERESTING_32 = INTERESTING_16 + [-2147483648, -100663046, -32769, 32768, 65535, 65536,
+                                   100663045, 2147483647]
+
+ARITH_MAX = 35  # Largest value added or subtracted by arithmetic mutations
+HAVOC_BLOCK_LENGTHS = [32, 128, 1500, 32768]  # Upper bounds of block lengths
+HAVOC_MAX_LENGTH = 1 << 20  # Do not grow inputs beyond this
+
+WORD_FORMATS = {1: ("<B", ">B"), 2: ("<H", ">H"), 4: ("<I", ">I")}
+
+
+def random_block_length(limit):
+    """A random block length of at most `limit`, biased towards short blocks"""
+    upper = HAVOC_BLOCK_LENGTHS[random.randrange(0, len(HAVOC_BLOCK_LENGTHS))]
+    return random.randint(1, max(1, min(upper, limit)))
+
+
+def delete_random_byte(buf):
+    """Delete a random byte of `buf`, in place"""
+    if len(buf) == 0:
+        return
+    del buf[random.randrange(0, len(buf))]
+
+
+def insert_random_byte(buf):
+    """Insert a random printable byte into `buf`, in place"""
+    buf.insert(random.randint(0, len(buf)), random.randrange(32, 127))
+
+
+def flip_random_bit(buf):
+    """Flip one of the lower 7 bits of a random byte of `buf`, in place"""
+    if len(buf) == 0:
+        return
+    buf[random.randrange(0, len(buf))] ^= 1 << random.randint(0, 6)
+
+
+def flip_random_bits(buf):
+    """Flip 1, 2 or 4 consecutive bits of `buf`, in place"""
+    if len(buf) == 0:
+        return
+    width = random.choice([1, 2, 4])
+    bit = random.randrange(0, len(buf) * 8 - width + 1)
+    for b in range(bit, bit + width):
+        buf[b >> 3] ^= 0x80 >> (b & 7)
+
+
+def flip_random_bytes(buf):
+    """Invert 1, 2 or 4 consecutive bytes of `buf`, in place"""
+    width = random.choice([1, 2, 4])
+    if len(buf) < width:
+        return
+    pos = random.randrange(0, len(buf) - width + 1)
+    for i in range(pos, pos + width):
+        buf[i] ^= 0xff
+
+
+def random_word(buf):
+    """Return `(format, position)` of a random 8/16/32-bit word in `buf`, or None"""
+    width = random.choice([1, 2, 4])
+    if len(buf) < width:
+        return None
+    fmt = WORD_FORMATS[width][random.randrange(0, 2)]
+    return fmt, random.randrange(0, len(buf) - width + 1)
+
+
+def random_arith(buf):
+    """Add or subtract a small value to a random 8/16/32-bit word of `buf`,
+    in either byte order, in place"""
+    word = random_word(buf)
+    if word is None:
+        return
+    fmt, pos = word
+    value, = struct.unpack_from(fmt, buf, pos)
+    delta = random.randint(1, ARITH_MAX) * random.choice([1, -1])
+    struct.pack_into(fmt, buf, pos, (value + delta) % (1 << (8 * struct.calcsize(fmt))))
+
+
+def random_interesting(buf):
+    """Overwrite a random 8/16/32-bit word of `buf` with an interesting value,
+    in either byte order, in place"""
+    word = random_word(buf)
+    if word is None:
+        return
+    fmt, pos = word
+    bits = 8 * struct.calcsize(fmt)
+    values = {8: INTERESTING_8, 16: INTERESTING_16, 32: INTERESTING_32}[bits]
+    struct.pack_into(fmt, buf, pos, random.choice(values) % (1 << bits))
+
+
+def random_byte(buf):
+    """Set a random byte of `buf` to a random value, in place"""
+    if len(buf) == 0:
+        return
+    buf[random.randrange(0, len(buf))] = random.randrange(0, 256)
+
+
+def delete_random_block(buf):
+    """Delete a random block of `buf`, in place"""
+    if len(buf) < 2:
+        return
+    length = random_block_length(len(buf) - 1)
+    pos = random.randrange(0, len(buf) - length + 1)
+    del buf[pos:pos + length]
+
+
+def clone_random_block(buf):
+    """Insert a copy of a random block of `buf`, or a block of a constant
+    byte, at a random position, in place"""
+    if len(buf) >= HAVOC_MAX_LENGTH:
+        return
+    if len(buf) > 0 and random.randrange(0, 4) > 0:
+        length = random_block_length(len(buf))
+        src = random.randrange(0, len(buf) - length + 1)
+        block = buf[src:src + length]
+    else:
+        length = random_block_length(HAVOC_BLOCK_LENGTHS[0])
+        block = bytes([random.randrange(0, 256)]) * length
+    pos = random.randint(0, len(buf))
+    buf[pos:pos] = block
+
+
+def overwrite_random_block(buf):
+    """Overwrite a random block of `buf` with another block of `buf`, or
+    with a constant byte, in place"""
+    if len(buf) < 2:
+        return
+    length = random_block_length(len(buf) - 1)
+    dst = random.randrange(0, len(buf) - length + 1)
+    if random.randrange(0, 4) > 0:
+        src = random.randrange(0, len(buf) - length + 1)
+        buf[dst:dst + length] = buf[src:src + length]
+    else:
+        buf[dst:dst + length] = bytes([random.randrange(0, 256)]) * length
+
+
+'''与 delete/insert/flip_random_character 对应的字节变异'''
+BYTE_MUTATORS = [
+    delete_random_byte,
+    insert_random_byte,
+    flip_random_bit
+]
+
+'''全部 havoc 变异'''
+HAVOC_MUTATORS = BYTE_MUTATORS + [
+    flip_random_bits,
+    flip_random_bytes,
+    random_arith,
+    random_interesting,
+    random_byte,
+    delete_random_block,
+    clone_random_block,
+    overwrite_random_block
+]
+
+
+def havoc(buf, trials=1, mutators=HAVOC_MUTATORS):
+    """Apply `trials` random `mutators` to the bytearray `buf`, in place"""
+    for i in range(trials):
+        random.choice(mutators)(buf)
+
+
 
 class MutationFuzzer(Fuzzer):
-    def __init__(self, seed, min_mutations=2, max_mutations=10):
+    def __init__(self, seed, min_mutations=2, max_mutations=10, schedule=None,
+                 mutator_scheduler=None):
+        """Mutate the inputs in `seed`.  If a `PowerSchedule` is given as
+        `schedule`, it chooses the input to mutate next.  If a
+        `MutatorScheduler` is given as `mutator_scheduler`, it chooses the
+        mutators and how many of them to apply."""
         self.seed = seed
         self.min_mutations = min_mutations
         self.max_mutations = max_mutations
+        self.schedule = schedule
+        self.mutator_scheduler = mutator_scheduler
+        if mutator_scheduler is not None and mutator_scheduler.depths is None:
+            mutator_scheduler.set_depths(range(min_mutations, max_mutations + 1))
         self.reset()
 
     def reset(self):
         self.population = self.seed
         self.seed_index = 0
+        if self.schedule is not None:
+            self.schedule.reset()
+            for inp in self.seed:
+                self.schedule.add_seed()
+
+    def choose_seed(self):
+        """Return the input to mutate next"""
+        if self.schedule is None:
+            return random.choice(self.population)
+        return self.population[self.schedule.choose()]
 
     def mutate(self, inp):
         return mutate(inp)
 
     def create_candidate(self):
-        candidate = random.choice(self.population)
+        candidate = self.choose_seed()
+        if self.mutator_scheduler is not None:
+            scheduler = self.mutator_scheduler
+            for i in range(scheduler.choose_depth()):
+                candidate = scheduler.choose_mutator()(candidate)
+            return candidate
+
         trials = random.randint(self.min_mutations, self.max_mutations)
         for i in range(trials):
             candidate = self.mutate(candidate)
@@ -160,10 +364,40 @@ class MutationFuzzer(Fuzzer):
         return self.inp
 
 
+class ByteMutationFuzzer(MutationFuzzer):
+    """A `MutationFuzzer` on `bytes`, mutating a single `bytearray` copy of
+    each candidate in place"""
+
+    def __init__(self, seed, min_mutations=2, max_mutations=10, mutators=HAVOC_MUTATORS,
+                 schedule=None, mutator_scheduler=None):
+        """`seed` is a list of `bytes` (or `str`, encoded as UTF-8);
+        `mutators` the in-place mutators to choose from, e.g. `BYTE_MUTATORS`.
+        A `mutator_scheduler` chooses among its own (in-place) mutators instead."""
+        seed = [s.encode('utf-8') if isinstance(s, str) else bytes(s) for s in seed]
+        self.mutators = mutators
+        super().__init__(seed, min_mutations, max_mutations, schedule, mutator_scheduler)
+
+    def mutate(self, inp):
+        buf = bytearray(inp)
+        havoc(buf, 1, self.mutators)
+        return bytes(buf)
+
+    def create_candidate(self):
+        buf = bytearray(self.choose_seed())
+        if self.mutator_scheduler is not None:
+            scheduler = self.mutator_scheduler
+            for i in range(scheduler.choose_depth()):
+                scheduler.choose_mutator()(buf)
+        else:
+            havoc(buf, random.randint(self.min_mutations, self.max_mutations), self.mutators)
+        return bytes(buf)
+
+
 class FunctionRunner(Runner):
     def __init__(self, function):
         """Initialize.  `function` is a function to be executed"""
         self.function = function
+        self.exception = None  # Raised by the last run
 
     def run_function(self, inp):
         return self.function(inp)
@@ -172,13 +406,208 @@ class FunctionRunner(Runner):
         try:
             result = self.run_function(inp)
             outcome = self.PASS
-        except Exception:
+            self.exception = None
+        except Exception as exc:
             result = None
             outcome = self.FAIL
+            self.exception = exc
 
         return result, outcome
 
+    def failure_signature(self, result):
+        """The exception type and a hash of the innermost frames"""
+        if self.exception is None:
+            return super().failure_signature(result)  # The last run passed
+        return exception_signature(self.exception)
+
+
+class FunctionCoverageRunner(FunctionRunner):
+    """A `FunctionRunner` that also collects the coverage of each run"""
+
+    def run_function(self, inp):
+        with Coverage() as cov:
+            try:
+                result = super().run_function(inp)
+            except Exception:
+                self._coverage = cov.branch_coverage()
+                raise
+
+        self._coverage = cov.branch_coverage()
+        return result
+
+    def coverage(self):
+        """The branches covered by the last run"""
+        return self._coverage
+
+
+class FunctionEdgeCoverageRunner(FunctionRunner):
+    """A `FunctionRunner` that collects edge coverage into an
+    `EdgeCoverage` bitmap, reused for all runs"""
+
+    def __init__(self, function, map_size=None):
+        super().__init__(function)
+        self.collector = EdgeCoverage() if map_size is None else EdgeCoverage(map_size)
+
+    def run_function(self, inp):
+        self.collector.reset()
+        with self.collector:
+            return super().run_function(inp)
+
+    def coverage(self):
+        """The bitmap entries covered by the last run"""
+        return self.collector.coverage()
+
+
+class MutationCoverageFuzzer(MutationFuzzer):
+    """Greybox fuzzing: inputs that cover new branches are added to the
+    population.  Use with a `FunctionCoverageRunner` or a
+    `FunctionEdgeCoverageRunner`."""
+
+    def reset(self):
+        super().reset()
+        self.population = list(self.seed)
+        self.total_coverage = set()
+        self.failures = CrashBuckets()  # Failing inputs by signature
+        self.outcomes_seen = set()
+        self.trials = 0
+        self.start_time = time.time()
+        self.timeline = []  # (seconds, trials, covered branches)
+
+    def run(self, runner):
+        """Run `runner` with fuzz input; keep the input if it covers new branches"""
+        seeding = self.seed_index < len(self.seed)  # Running a seed itself
+        result, outcome = super().run(runner)
+        self.trials += 1
+        coverage = runner.coverage()
+        new_coverage = coverage - self.total_coverage
+        added = False
+        if new_coverage:
+            self.total_coverage |= new_coverage
+            self.timeline.append((time.time() - self.start_time, self.trials,
+                                  len(self.total_coverage)))
+            if outcome == Runner.PASS and not seeding:
+                self.population.append(self.inp)
+                added = True
+
+        new_outcome = outcome not in self.outcomes_seen
+        self.outcomes_seen.add(outcome)
+        if self.mutator_scheduler is not None and not seeding:
+            self.mutator_scheduler.reward(bool(new_coverage) or new_outcome)
+
+        if self.schedule is not None:
+            path = hash(frozenset(coverage))
+            self.schedule.path_exercised(path)
+            if seeding:
+                self.schedule.set_path(self.seed_index - 1, path)
+            elif added:
+                self.schedule.add_seed(path)
+        if outcome == Runner.FAIL:
+            self.failures.add(runner.failure_signature(result), self.inp)
+        return (result, outcome)
+
+    def coverage_over_time(self):
+        """Return `(seconds, trials, covered branches)` for each time coverage grew"""
+        return self.timeline
+
 #http_runner 测试
 if __name__ == "__main__":
     http_runner = FunctionRunner(http_program)
-    http_runner.run("https://www.lofter.com/")
\ No newline at end of file
+    http_runner.run("https://www.lofter.com/")
+
+
+def crashme(s):
+    """Fails only on inputs starting with `bad!`"""
+    if len(s) > 0 and s[0] == 'b':
+        if len(s) > 1 and s[1] == 'a':
+            if len(s) > 2 and s[2] == 'd':
+                if len(s) > 3 and s[3] == '!':
+                    raise Exception()
+
+
+if __name__ == "__main__":
+    '''灰盒 (覆盖率引导) 与黑盒变异对比：找到 crashme 的崩溃输入所需的次数'''
+    trials = 20000
+    for fuzzer_class in [MutationFuzzer, MutationCoverageFuzzer]:
+        random.seed(0)
+        fuzzer = fuzzer_class(["good"])
+        runner = FunctionEdgeCoverageRunner(crashme)
+        found = None
+        for i in range(trials):
+            result, outcome = fuzzer.run(runner)
+            if outcome == Runner.FAIL:
+                found = i + 1
+                break
+        print("%-22s %s" % (fuzzer_class.__name__,
+                            "crash after %d trials: %r" % (found, fuzzer.inp)
+                            if found else "no crash in %d trials" % trials))
+        if fuzzer_class is MutationCoverageFuzzer:
+            for (seconds, n, covered) in fuzzer.coverage_over_time():
+                print("  %6.3fs %6d trials %4d branches" % (seconds, n, covered))
+
+
+if __name__ == "__main__":
+    '''不同能量调度下，找到 crashme 崩溃输入所需的平均次数'''
+    try:
+        from nfuzz.Schedulers import PowerSchedule, AFLFastSchedule, RecencySchedule
+    except ImportError:
+        from .Schedulers import PowerSchedule, AFLFastSchedule, RecencySchedule
+
+    for schedule in [None, PowerSchedule(), AFLFastSchedule(), RecencySchedule(half_life=2)]:
+        found = []
+        for run in range(10):
+            random.seed(run)
+            fuzzer = MutationCoverageFuzzer(["good"], schedule=schedule)
+            runner = FunctionEdgeCoverageRunner(crashme)
+            for i in range(50000):
+                result, outcome = fuzzer.run(runner)
+                if outcome == Runner.FAIL:
+                    break
+            found.append(i + 1)
+        print("%-16s %8.0f trials to crash on average" %
+              (type(schedule).__name__ if schedule else "random.choice",
+               sum(found) / len(found)))
+
+
+if __name__ == "__main__":
+    '''自适应变异调度 (多臂老虎机)：找到 crashme 崩溃输入所需的平均次数，并输出统计'''
+    import json
+    try:
+        from nfuzz.Schedulers import Bandit, UCBBandit, ThompsonBandit, MutatorScheduler
+    except ImportError:
+        from .Schedulers import Bandit, UCBBandit, ThompsonBandit, MutatorScheduler
+
+    for bandit in [Bandit, UCBBandit, ThompsonBandit]:
+        found = []
+        for run in range(10):
+            random.seed(run)
+            scheduler = MutatorScheduler(MUTATORS, bandit=bandit)
+            fuzzer = MutationCoverageFuzzer(["good"], mutator_scheduler=scheduler)
+            runner = FunctionEdgeCoverageRunner(crashme)
+            for i in range(50000):
+                result, outcome = fuzzer.run(runner)
+                if outcome == Runner.FAIL:
+                    break
+            found.append(i + 1)
+        print("%-16s %8.0f trials to crash on average" %
+              (bandit.__name__, sum(found) / len(found)))
+    print(json.dumps(scheduler.stats()["mutators"]))
+
+if __name__ == "__main__":
+    '''对比字符串变异与字节原地变异在大种子上的速度'''
+    import time
+
+    seed = "".join(chr(random.randrange(32, 127)) for i in range(300 * 1024))
+    trials = 200
+    for fuzzer in [MutationFuzzer([seed]),
+                   ByteMutationFuzzer([seed], mutators=BYTE_MUTATORS),
+                   ByteMutationFuzzer([seed])]:
+        fuzzer.fuzz()  # The seed itself
+        start_time = time.time()
+        for i in range(trials):
+            fuzzer.fuzz()
+        elapsed = time.time() - start_time
+        print("%-20s %-14s %8.0f candidates/s" %
+              (type(fuzzer).__name__,
+               "" if not isinstance(fuzzer, ByteMutationFuzzer) else
+               "byte mutators" if fuzzer.mutators is BYTE_MUTATORS else "havoc",
+               trials / elapsed))
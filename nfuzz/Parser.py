@@ -0,0 +1,447 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8  -*-
+'''
+@author: sunqiao
+@contact: sunqiao@corp.netease.com
+@time: 2021/5/6 10:30
+@desc:Fuzzing with Grammers
+MIT License
+
+Copyright (c) 2021 alexqiaodan
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+from array import array
+from bisect import bisect_left, bisect_right
+
+if __package__ is None or __package__ == "":
+    from nfuzz.Grammars import START_SYMBOL, compile_grammar, instantiate_template
+else:
+    from .Grammars import START_SYMBOL, compile_grammar, instantiate_template
+
+
+class EarleyParser(object):
+    """Parse strings with a grammar (as used by `GrammarFuzzer`) into
+    `(symbol, children)` derivation trees.
+
+    This is an Earley parser with Leo's optimization for right recursion,
+    so that unambiguous grammars parse in linear time.  Items are kept in
+    a `Chart` of flat arrays with back pointers, from which one
+    derivation tree is built without recursion.  For ambiguous input,
+    the first derivation found is returned."""
+
+    # Items added by a Leo (transitive) completion of an item from
+    # position `p` have `LEO - p` as their previous item
+    LEO = -2
+
+    def __init__(self, grammar, start_symbol=START_SYMBOL):
+        self.grammar = grammar
+        self.start_symbol = start_symbol
+        compiled = self.compiled = compile_grammar(grammar)
+        n = compiled.n_nonterminals
+        symbols = compiled.symbols
+
+        # Dotted rules ("states"), numbered consecutively per rule
+        self.state_lhs = []  # state -> nonterminal id
+        self.state_dot = []
+        self.state_next = []  # state -> symbol id after the dot, or -1
+        self.state_before = []  # state -> symbol id before the dot, or -1
+        self.state_epsilon = []  # state -> True if the rule expands to ""
+        self.rule_starts = [[] for sid in range(n)]  # nonterminal -> start states
+        self.char_rules = [{} for sid in range(n)]  # nonterminal -> char -> end states
+
+        for sid in range(n):
+            for tokens in compiled.expansions[sid]:
+                rhs = [t for t in tokens if t < n or symbols[t] != ""]
+                start = len(self.state_lhs)
+                for dot in range(len(rhs) + 1):
+                    self.state_lhs.append(sid)
+                    self.state_dot.append(dot)
+                    self.state_next.append(rhs[dot] if dot < len(rhs) else -1)
+                    self.state_before.append(rhs[dot - 1] if dot > 0 else -1)
+                    self.state_epsilon.append(len(rhs) == 0)
+                if len(rhs) == 1 and rhs[0] >= n and len(symbols[rhs[0]]) == 1:
+                    # Single characters are scanned right when predicted
+                    self.char_rules[sid].setdefault(symbols[rhs[0]], []).append(start + 1)
+                else:
+                    self.rule_starts[sid].append(start)
+
+        self.nullable, self.null_templates = self.compute_nullable()
+
+    def compute_nullable(self):
+        """Return the nullable nonterminals, and a template of a tree
+        deriving "" for each"""
+        compiled = self.compiled
+        n = compiled.n_nonterminals
+        templates = {}
+        changed = True
+        while changed:
+            changed = False
+            for sid in range(n):
+                if sid in templates:
+                    continue
+                for tokens in compiled.expansions[sid]:
+                    if all(t >= n and compiled.symbols[t] == "" for t in tokens):
+                        templates[sid] = (compiled.symbols[sid], (("", ()),))
+                    elif all(t in templates or (t >= n and compiled.symbols[t] == "")
+                             for t in tokens):
+                        templates[sid] = (compiled.symbols[sid],
+                                          tuple(templates[t] for t in tokens if t < n))
+                    else:
+                        continue
+                    changed = True
+                    break
+        return set(templates), templates
+
+    def parse(self, text):
+        """Return a derivation tree for `text`; raise `SyntaxError` if
+        there is none"""
+        chart = self.chart(text)
+        n = len(text)
+        start = self.compiled.ids[self.start_symbol]
+        for item in range(chart.offsets[n], chart.offsets[n + 1]):
+            state = chart.states[item]
+            if chart.origins[item] == 0 and self.state_lhs[state] == start and \
+                    self.state_next[state] == -1:
+                return self.build_tree(chart, item)
+
+        position = max(i for i in range(n + 1)
+                       if chart.offsets[i] < chart.offsets[i + 1])
+        raise SyntaxError("at " + repr(text[position:position + 40]))
+
+    def recognize(self, text):
+        """True if `text` can be derived from the start symbol"""
+        try:
+            self.parse(text)
+        except SyntaxError:
+            return False
+        return True
+
+    def chart(self, text):
+        """Run the Earley algorithm over `text`; return the chart"""
+        n = len(text)
+        chart = Chart(n)
+        state_next = self.state_next
+        state_lhs = self.state_lhs
+        rule_starts = self.rule_starts
+        char_rules = self.char_rules
+        nullable = self.nullable
+        n_nonterminals = self.compiled.n_nonterminals
+        symbols = self.compiled.symbols
+        states = chart.states
+        origins = chart.origins
+        add = chart.add
+        leo_item = self.leo_item
+        leo_states = chart.leo_states
+        leo_origins = chart.leo_origins
+
+        start = self.compiled.ids[self.start_symbol]
+        chart.open(0)
+        for s in rule_starts[start]:
+            add(0, s, 0, -1, -1)
+        for c_state in char_rules[start].get(text[0:1], []):
+            add(1, c_state, 0, -1, -1)
+
+        for i in range(n + 1):
+            if i > 0:
+                chart.open(i)
+            waiting = {}  # symbol -> items at `i` waiting for it
+            predicted = set()
+            char = text[i:i + 1]
+            item = chart.offsets[i]
+            while item < len(states):
+                state = states[item]
+                origin = origins[item]
+                symbol = state_next[state]
+
+                if symbol == -1:
+                    # Completion
+                    lhs = state_lhs[state]
+                    if origin < i:
+                        leo = leo_item(chart, origin, lhs)
+                        if leo is not None:
+                            add(i, leo_states[leo], leo_origins[leo],
+                                self.LEO - origin, item)
+                        else:
+                            for w in chart.waiters(origin, lhs):
+                                add(i, states[w] + 1, origins[w], w, item)
+                    else:
+                        for w in waiting.get(lhs, ()):
+                            add(i, states[w] + 1, origins[w], w, item)
+
+                elif symbol < n_nonterminals:
+                    # Prediction
+                    waiting.setdefault(symbol, []).append(item)
+                    if symbol not in predicted:
+                        predicted.add(symbol)
+                        for s in rule_starts[symbol]:
+                            add(i, s, i, -1, -1)
+                        for c_state in char_rules[symbol].get(char, ()):
+                            add(i + 1, c_state, i, -1, -1)
+                    if symbol in nullable:
+                        add(i, state + 1, origin, item, -1)
+
+                else:
+                    # Scanning
+                    terminal = symbols[symbol]
+                    if text.startswith(terminal, i):
+                        add(i + len(terminal), state + 1, origin, item, -1)
+                item += 1
+
+            chart.close(i, waiting)
+        return chart
+
+    def leo_item(self, chart, origin, lhs):
+        """Return the Leo item for completing `lhs` from position `origin`
+        (an index into the chart's Leo arrays), or None if the completion
+        is not deterministic"""
+        n_nonterminals = self.compiled.n_nonterminals
+        leo = chart.leo
+        key = origin * n_nonterminals + lhs
+        if key in leo:
+            return leo[key]
+
+        # Follow the chain of deterministic completions upwards, then fill
+        # in the memo from the top down.  Only deterministic completions
+        # are memoized; finding that one is not takes one lookup.
+        path = []
+        position, symbol = origin, lhs
+        top = None
+        while True:
+            key = position * n_nonterminals + symbol
+            if key in leo:
+                top = leo[key]
+                break
+            waiters = chart.waiters(position, symbol)
+            if len(waiters) != 1:
+                break
+            w = waiters[0]
+            w_state = chart.states[w]
+            if self.state_next[w_state + 1] != -1:
+                break  # Not the last symbol of its rule
+            path.append((key, w, w_state))
+            position, symbol = chart.origins[w], self.state_lhs[w_state]
+
+        if not path:
+            return None
+        if top is None:
+            key, w, w_state = path.pop()
+            top = chart.add_leo(key, w_state + 1, chart.origins[w], w, -1)
+        while path:
+            next_key = key
+            key, w, w_state = path.pop()
+            top = chart.add_leo(key, chart.leo_states[top], chart.leo_origins[top],
+                                w, next_key)
+        return top
+
+    def item_refs(self, chart, item):
+        """Return references to the children of `item`, for the symbols
+        before its dot"""
+        state_before = self.state_before
+        state_dot = self.state_dot
+        refs = []
+        while True:
+            state = chart.states[item]
+            if state_dot[state] == 0:
+                break
+            symbol = state_before[state]
+            child = chart.children[item]
+            if symbol >= self.compiled.n_nonterminals:
+                refs.append((0, self.compiled.symbols[symbol]))
+            elif child == -1:
+                refs.append((1, symbol))
+            else:
+                refs.append((2, child))
+            if state_dot[state] == 1:
+                break
+            item = chart.prevs[item]
+        refs.reverse()
+        return refs
+
+    def expand(self, chart, ref):
+        """Return `(symbol, child references)` for a reference to a complete
+        item (2, item) or to a level of a Leo chain (3, chain, level, child)"""
+        if ref[0] == 3:
+            _, chain, level, child = ref
+            w = chain[level]
+            refs = self.item_refs(chart, w)
+            refs.append((3, chain, level - 1, child) if level > 0 else child)
+            return self.state_lhs[chart.states[w]], refs
+
+        item = ref[1]
+        state = chart.states[item]
+        prev = chart.prevs[item]
+        if prev > self.LEO:
+            if self.state_epsilon[state]:
+                return self.state_lhs[state], [(0, "")]
+            return self.state_lhs[state], self.item_refs(chart, item)
+
+        # Added by a Leo completion: rebuild the chain of completions
+        # from the completed child up to this item
+        child = (2, chart.children[item])
+        symbol = self.state_lhs[chart.states[child[1]]]
+        chain = []
+        key = (self.LEO - prev) * self.compiled.n_nonterminals + symbol
+        while key != -1:
+            top = chart.leo[key]
+            chain.append(chart.leo_waiters[top])
+            key = chart.leo_next[top]
+        return self.expand(chart, (3, chain, len(chain) - 1, child))
+
+    def build_tree(self, chart, item):
+        symbols = self.compiled.symbols
+        symbol, refs = self.expand(chart, (2, item))
+        root = (symbols[symbol], [])
+        stack = [(root[1], refs, 0)]
+        while stack:
+            children, refs, k = stack.pop()
+            while k < len(refs):
+                ref = refs[k]
+                k += 1
+                if ref[0] == 0:
+                    children.append((ref[1], []))
+                elif ref[0] == 1:
+                    children.append(instantiate_template(self.null_templates[ref[1]]))
+                else:
+                    symbol, sub_refs = self.expand(chart, ref)
+                    node = (symbols[symbol], [])
+                    children.append(node)
+                    stack.append((children, refs, k))
+                    stack.append((node[1], sub_refs, 0))
+                    break
+        return root
+
+
+class Chart(object):
+    """Earley items of all input positions, in flat parallel arrays: the
+    dotted rule, the origin, the previous item and the child item.  The
+    items of position `i` are `offsets[i]` ... `offsets[i + 1] - 1`.
+    Positions are filled in order; items for later positions (scanned
+    terminals) wait in `pending` until their position is opened.  Items
+    waiting for a nonterminal are kept the same way, sorted by symbol."""
+
+    def __init__(self, n):
+        self.n = n
+        self.states = array('i')
+        self.origins = array('l')
+        self.prevs = array('l')  # Previous item; <= LEO for Leo completions
+        self.children = array('l')
+        self.offsets = array('l', [0]) * (n + 2)
+        self.waiting_symbols = array('i')
+        self.waiting_items = array('l')
+        self.waiting_offsets = array('l', [0]) * (n + 2)
+        # Leo items of deterministic completions: the top state and
+        # origin of the chain, the waiting item completed, and the key of
+        # the next Leo item up the chain, or -1
+        self.leo = {}  # position * nonterminals + symbol -> Leo item
+        self.leo_states = array('l')
+        self.leo_origins = array('l')
+        self.leo_waiters = array('l')
+        self.leo_next = array('l')
+        self.pending = {}  # position -> {key: item}
+        self.position = -1  # The open position
+        self.keys = None  # Keys of the items at the open position
+
+    def open(self, position):
+        self.position = position
+        self.keys = set()
+        for key, item in self.pending.pop(position, {}).items():
+            self.add(position, *item)
+
+    def close(self, position, waiting):
+        """Close `position`; `waiting` maps symbols to the items waiting for them"""
+        self.keys = None
+        self.offsets[position + 1] = len(self.states)
+        for symbol in sorted(waiting):
+            items = waiting[symbol]
+            self.waiting_symbols.extend([symbol] * len(items))
+            self.waiting_items.extend(items)
+        self.waiting_offsets[position + 1] = len(self.waiting_items)
+
+    def waiters(self, position, symbol):
+        """Return the items at the closed `position` waiting for `symbol`"""
+        low, high = self.waiting_offsets[position], self.waiting_offsets[position + 1]
+        low = bisect_left(self.waiting_symbols, symbol, low, high)
+        high = bisect_right(self.waiting_symbols, symbol, low, high)
+        return self.waiting_items[low:high]
+
+    def add_leo(self, key, state, origin, waiter, next_key):
+        leo = self.leo[key] = len(self.leo_states)
+        self.leo_states.append(state)
+        self.leo_origins.append(origin)
+        self.leo_waiters.append(waiter)
+        self.leo_next.append(next_key)
+        return leo
+
+    def add(self, position, state, origin, prev, child):
+        if position > self.n:
+            return
+        key = state * (self.n + 1) + origin
+        if position != self.position:
+            self.pending.setdefault(position, {}).setdefault(
+                key, (state, origin, prev, child))
+            return
+        if key in self.keys:
+            return
+        self.keys.add(key)
+        self.states.append(state)
+        self.origins.append(origin)
+        self.prevs.append(prev)
+        self.children.append(child)
+
+
+if __name__ == "__main__":
+    '''解析 GrammarFuzzer 生成的输入并还原派生树; 右递归长输入的解析时间应随长度线性增长'''
+    import random
+    import time
+
+    if __package__ is None or __package__ == "":
+        from nfuzz.GrammarFuzzer import GrammarFuzzer, tree_to_string
+        from nfuzz.Grammars import CGI_GRAMMAR, EXPR_EBNF_GRAMMAR, EXPR_GRAMMAR, \
+            URL_GRAMMAR, convert_ebnf_grammar
+    else:
+        from .GrammarFuzzer import GrammarFuzzer, tree_to_string
+        from .Grammars import CGI_GRAMMAR, EXPR_EBNF_GRAMMAR, EXPR_GRAMMAR, \
+            URL_GRAMMAR, convert_ebnf_grammar
+
+    random.seed(0)
+    for grammar in [EXPR_GRAMMAR, URL_GRAMMAR, CGI_GRAMMAR,
+                    convert_ebnf_grammar(EXPR_EBNF_GRAMMAR)]:
+        parser = EarleyParser(grammar)
+        fuzzer = GrammarFuzzer(grammar)
+        for i in range(100):
+            s = fuzzer.fuzz()
+            assert tree_to_string(parser.parse(s)) == s
+
+    tree = EarleyParser(EXPR_GRAMMAR).parse("2 + (3 * 4)")
+    print(tree[1][0][0], [child[0] for child in tree[1][0][1]])
+
+    for grammar, make in [
+            (EXPR_GRAMMAR, lambda n: " + ".join(str(random.randint(0, 999))
+                                                for i in range(n // 6))),
+            (EXPR_GRAMMAR, lambda n: "(" * (n // 2) + "1" + ")" * (n // 2)),
+            (CGI_GRAMMAR, lambda n: "ab%20c+" * (n // 7))]:
+        parser = EarleyParser(grammar)
+        for n in [10000, 20000, 40000]:
+            s = make(n)
+            start = time.time()
+            tree = parser.parse(s)
+            elapsed = time.time() - start
+            assert tree_to_string(tree) == s
+            print("%7d chars: %5.2fs, %6.0f chars/s" % (len(s), elapsed, len(s) / elapsed))
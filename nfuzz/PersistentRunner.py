@@ -0,0 +1,380 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8  -*-
+'''
+@author: sunqiao
+@contact: sunqiao@corp.netease.com
+@time: 2021/5/12 11:40
+@desc:Fuzzing with Grammers
+MIT License
+
+Copyright (c) 2021 alexqiaodan
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+import io
+import logging
+import os
+import select
+import signal
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+
+if __package__ is None or __package__ == "":
+    from nfuzz.Fuzzer import ProgramRunner
+else:
+    from .Fuzzer import ProgramRunner
+
+# Protocol between `PersistentProgramRunner` and `persistent_main()`, on
+# a pair of pipes of its own: the target first writes MAGIC; then, for
+# each input, the runner writes REQUEST (length) + input, and the target
+# answers with RESPONSE (returncode, stdout length, stderr length) +
+# stdout + stderr.
+MAGIC = b"NFZ1"
+REQUEST = struct.Struct("<I")
+RESPONSE = struct.Struct("<iII")
+
+# Tells the target to serve inputs: "persistent" or "fork"
+SERVER_ENV = "NFUZZ_SERVER"
+# The target's ends of the protocol pipes: "<read fd>,<write fd>"
+FDS_ENV = "NFUZZ_FDS"
+
+logger = logging.getLogger(__name__)
+
+
+def _read_exact(fd, size):
+    chunks = []
+    while size:
+        chunk = os.read(fd, size)
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def _write_all(fd, data):
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+
+def _exit_status(status):
+    """Turn what `function` returned into an exit status, as `sys.exit()`
+    would: None is 0, ints (and bools) are taken modulo 256, others are 1"""
+    if status is None:
+        return 0
+    try:
+        return int(status) & 0xFF
+    except (TypeError, ValueError):
+        return 1
+
+
+def _call(function, data, binary):
+    """Run `function` on `data` with stdout and stderr captured; return the
+    RESPONSE frame"""
+    out, err = io.BytesIO(), io.BytesIO()
+    saved = sys.stdout, sys.stderr
+    sys.stdout = io.TextIOWrapper(out, "utf-8", "surrogateescape", write_through=True)
+    sys.stderr = io.TextIOWrapper(err, "utf-8", "surrogateescape", write_through=True)
+    try:
+        status = function(data if binary else data.decode("utf-8", "surrogateescape"))
+    except SystemExit as exc:
+        status = exc.code
+    except Exception:
+        traceback.print_exc()
+        status = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        stdout, stderr = out.getvalue(), err.getvalue()
+        sys.stdout, sys.stderr = saved
+    return RESPONSE.pack(_exit_status(status), len(stdout), len(stderr)) + stdout + stderr
+
+
+def _fork_call(function, data, binary):
+    """Like `_call()`, but in a forked child, so that crashes and changes
+    to global state do not affect the server"""
+    sys.stdout.flush()
+    sys.stderr.flush()
+    r, w = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.close(r)
+            _write_all(w, _call(function, data, binary))
+        finally:
+            os._exit(0)
+    os.close(w)
+    chunks = []
+    while True:
+        chunk = os.read(r, 65536)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    os.close(r)
+    _, status = os.waitpid(pid, 0)
+    if os.WIFSIGNALED(status):
+        return RESPONSE.pack(-os.WTERMSIG(status), 0, 0)
+    return b"".join(chunks)
+
+
+def persistent_main(function, binary=False):
+    """Main program of a target that opts in to persistent execution.
+    `function` gets the input (a string, or bytes if `binary`), writes its
+    output to `sys.stdout`/`sys.stderr` and returns the exit code, like
+    the argument of `sys.exit()`: None for 0, an int, or anything else for 1.
+
+    Started by a `PersistentProgramRunner`, the target serves one input
+    after the other: in this process ("persistent") or in a child forked
+    from it for each input ("fork").  Otherwise, it runs `function` once
+    on stdin, like a plain program."""
+    mode = os.environ.pop(SERVER_ENV, None)
+    fds = os.environ.pop(FDS_ENV, None)
+    if mode is None or fds is None:
+        data = sys.stdin.buffer.read()
+        sys.exit(function(data if binary else data.decode("utf-8", "surrogateescape")))
+
+    proto_in, proto_out = [int(fd) for fd in fds.split(",")]
+    os.set_inheritable(proto_in, False)
+    os.set_inheritable(proto_out, False)
+    call = _fork_call if mode == "fork" else _call
+
+    _write_all(proto_out, MAGIC)
+    while True:
+        header = _read_exact(proto_in, REQUEST.size)
+        if header is None:
+            break  # Runner is done
+        data = _read_exact(proto_in, REQUEST.unpack(header)[0])
+        if data is None:
+            break
+        _write_all(proto_out, call(function, data, binary))
+    sys.exit(0)
+
+
+class PersistentProgramRunner(ProgramRunner):
+    """Run inputs in one long-lived target process, which must call
+    `persistent_main()`; with `fork`, the target forks a child from its
+    warm state for each input instead.  Both modes need `persistent_main()`:
+    it is the target that serves inputs, and forks.
+
+    The target is restarted after it crashes or does not answer within
+    `timeout` seconds; a hang is reported as being killed by SIGKILL.
+
+    The protocol runs on pipes of its own, and the target's stdin is empty.
+    A target that does not call `persistent_main()` thus runs once on empty
+    input and exits; from then on, with a warning, it is run once per input,
+    like with `ProgramRunner`.  So is a target that neither serves nor exits
+    within `startup_timeout` seconds."""
+
+    def __init__(self, program, timeout=1.0, fork=False, startup_timeout=10.0):
+        super().__init__(program)
+        self.timeout = timeout
+        self.fork = fork
+        self.startup_timeout = startup_timeout
+        self.process = None
+        self.persistent = True  # False if the target does not serve
+        self.restarts = 0
+
+    def start(self):
+        target_in, self.to_target = os.pipe()
+        self.from_target, target_out = os.pipe()
+        env = dict(os.environ)
+        env[SERVER_ENV] = "fork" if self.fork else "persistent"
+        env[FDS_ENV] = "%d,%d" % (target_in, target_out)
+        self.stderr_file = tempfile.TemporaryFile()
+        # In a session of its own, so that killing its process group also
+        # kills the children of a fork server.  Output not captured by
+        # `persistent_main()` goes to the stderr file.
+        try:
+            self.process = subprocess.Popen(self.program, stdin=subprocess.DEVNULL,
+                                            stdout=self.stderr_file,
+                                            stderr=self.stderr_file, env=env,
+                                            pass_fds=(target_in, target_out),
+                                            start_new_session=True)
+        except BaseException:
+            os.close(self.to_target)
+            os.close(self.from_target)
+            raise
+        finally:
+            os.close(target_in)
+            os.close(target_out)
+        magic, timed_out = self.read(len(MAGIC), time.time() + self.startup_timeout)
+        if magic != MAGIC:
+            self.stop()
+            self.persistent = False
+            logger.warning("%s does not serve inputs (%s); running it once per input",
+                           self.program, "no answer within %gs" % self.startup_timeout
+                           if timed_out else "it exited")
+
+    def stop(self):
+        """Terminate the target process"""
+        if self.process is None:
+            return
+        self.kill()
+        os.close(self.to_target)
+        os.close(self.from_target)
+        self.stderr_file.close()
+        self.process = None
+
+    close = stop
+
+    def kill(self):
+        """Kill the target and all processes it forked; wait for the target"""
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass  # All gone already
+        self.process.wait()
+
+    def write(self, data, deadline):
+        """Write `data` to the target; return True if that did not finish
+        before `deadline`.  Raises `BrokenPipeError` if the target exited."""
+        fd = self.to_target
+        os.set_blocking(fd, False)
+        view = memoryview(data)
+        while view:
+            remaining = deadline - time.time()
+            if remaining <= 0 or not select.select([], [fd], [], remaining)[1]:
+                return True
+            try:
+                view = view[os.write(fd, view):]
+            except BlockingIOError:
+                pass
+        return False
+
+    def read(self, size, deadline):
+        """Read `size` bytes from the target; return `(data, timed_out)`.
+        `data` is short if the target exited."""
+        fd = self.from_target
+        chunks = []
+        while size:
+            remaining = deadline - time.time()
+            if remaining <= 0 or not select.select([fd], [], [], remaining)[0]:
+                return b"".join(chunks), True
+            chunk = os.read(fd, size)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            size -= len(chunk)
+        return b"".join(chunks), False
+
+    def stderr_tail(self, size=4096):
+        self.stderr_file.seek(0, os.SEEK_END)
+        self.stderr_file.seek(max(0, self.stderr_file.tell() - size))
+        return self.stderr_file.read()
+
+    def run_process(self, inp=""):
+        """Run the target with `inp` as input.  Return a `subprocess.CompletedProcess`."""
+        text = isinstance(inp, str)
+        if self.persistent and self.process is None:
+            self.start()
+        if not self.persistent:
+            return subprocess.run(self.program, input=inp, stdout=subprocess.PIPE,
+                                  stderr=subprocess.PIPE, universal_newlines=text)
+
+        data = inp.encode("utf-8", "surrogateescape") if text else inp
+        deadline = time.time() + self.timeout
+        try:
+            header = b""
+            timed_out = self.write(REQUEST.pack(len(data)) + data, deadline)
+            if not timed_out:
+                header, timed_out = self.read(RESPONSE.size, deadline)
+        except BrokenPipeError:
+            header, timed_out = b"", False
+
+        stdout = stderr = b""
+        if len(header) == RESPONSE.size:
+            returncode, stdout_size, stderr_size = RESPONSE.unpack(header)
+            body, timed_out = self.read(stdout_size + stderr_size, deadline)
+            if len(body) == stdout_size + stderr_size:
+                stdout, stderr = body[:stdout_size], body[stdout_size:]
+                timed_out = None  # Done
+
+        if timed_out is not None:
+            if timed_out:
+                returncode = -signal.SIGKILL
+                self.kill()
+                stderr = self.stderr_tail() + b"timeout\n"
+            else:
+                returncode = self.process.wait()
+                stderr = self.stderr_tail()
+            self.stop()
+            self.restarts += 1
+
+        if text:
+            stdout = stdout.decode("utf-8", "replace")
+            stderr = stderr.decode("utf-8", "replace")
+        return subprocess.CompletedProcess(self.program, returncode, stdout, stderr)
+
+
+if __name__ == "__main__":
+    '''对比每次 fork+exec (ProgramRunner) 与常驻进程 / fork server 的执行速度, 并验证崩溃和挂起后的自动重启'''
+    import random
+
+    if __package__ is None or __package__ == "":
+        from nfuzz.Fuzzer import fuzzer
+    else:
+        from .Fuzzer import fuzzer
+
+    target = os.path.join(tempfile.mkdtemp(), "target.py")
+    with open(target, "w") as f:
+        f.write("""
+import os
+import sys
+import json, email.parser, decimal  # Startup work
+from nfuzz.PersistentRunner import persistent_main
+
+def main(s):
+    if s.startswith("crash"):
+        os.abort()
+    if s.startswith("hang"):
+        while True:
+            pass
+    if s.startswith("error"):
+        raise ValueError(s)
+    print(len(s))
+
+persistent_main(main)
+""")
+    os.environ["PYTHONPATH"] = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    program = [sys.executable, target]
+
+    random.seed(0)
+    inputs = [fuzzer() for i in range(100)]
+    for name, runner in [("ProgramRunner", ProgramRunner(program)),
+                         ("persistent", PersistentProgramRunner(program)),
+                         ("fork server", PersistentProgramRunner(program, fork=True))]:
+        start = time.time()
+        for inp in inputs:
+            result, outcome = runner.run(inp)
+            assert outcome == runner.PASS and result.stdout == "%d\n" % len(inp)
+        elapsed = time.time() - start
+        print("%-14s %7.0f execs/s" % (name, len(inputs) / elapsed))
+
+        if name != "ProgramRunner":
+            for inp in ["crash", "error", "hang", "ok"]:
+                result, outcome = runner.run(inp)
+                print("   %-6s %-10s returncode %4d, %d restart(s), %s" %
+                      (inp, outcome, result.returncode, runner.restarts,
+                       runner.failure_signature(result)))
+            runner.close()
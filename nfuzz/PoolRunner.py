@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8  -*-
+'''
+@author: sunqiao
+@contact: sunqiao@corp.netease.com
+@time: 2021/5/14 15:30
+@desc:Fuzzing with Grammers
+MIT License
+
+Copyright (c) 2021 alexqiaodan
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+import asyncio
+import os
+import signal
+import subprocess
+
+if __package__ is None or __package__ == "":
+    from nfuzz.Fuzzer import ProgramRunner
+else:
+    from .Fuzzer import ProgramRunner
+
+
+class TailBuffer(object):
+    """A ring buffer keeping the last `limit` bytes written to it"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.buffer = bytearray(limit)
+        self.position = 0  # Where the next byte goes
+        self.total = 0  # Bytes written, including those dropped
+
+    def write(self, data):
+        limit = self.limit
+        size = len(data)
+        self.total += size
+        if limit == 0:
+            return
+        if size >= limit:
+            self.buffer[:] = data[size - limit:]
+            self.position = 0
+            return
+        end = self.position + size
+        if end <= limit:
+            self.buffer[self.position:end] = data
+        else:
+            split = limit - self.position
+            self.buffer[self.position:] = data[:split]
+            self.buffer[:size - split] = data[split:]
+        self.position = end % limit
+
+    @property
+    def truncated(self):
+        return self.total > self.limit
+
+    def getvalue(self):
+        if self.total < self.limit:
+            return bytes(self.buffer[:self.total])
+        return bytes(self.buffer[self.position:] + self.buffer[:self.position])
+
+
+class ProgramRunnerPool(ProgramRunner):
+    """Run a program on many inputs concurrently with asyncio subprocesses.
+
+    At most `concurrency` processes run at a time.  Of stdout and stderr,
+    only the last `max_output` bytes each are kept; the result's
+    `stdout_size` and `stderr_size` hold the full sizes.  Runs taking
+    longer than `timeout` seconds are killed (returncode -SIGKILL), with
+    all the processes they forked.
+    Input and output are strings, or bytes if the input is bytes."""
+
+    drain_timeout = 1.0  # Seconds to collect output after a kill
+
+    def __init__(self, program, concurrency=None, max_output=65536, timeout=None):
+        super().__init__(program)
+        self.concurrency = concurrency or os.cpu_count() or 1
+        self.max_output = max_output
+        self.timeout = timeout
+
+    def args(self):
+        if isinstance(self.program, (str, bytes)):
+            return [self.program]
+        return list(self.program)
+
+    async def capture(self, stream, buffer):
+        while True:
+            chunk = await stream.read(65536)
+            if not chunk:
+                break
+            buffer.write(chunk)
+
+    async def feed(self, stream, data):
+        try:
+            stream.write(data)
+            await stream.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # The program does not read all of its input
+        stream.close()
+
+    def kill(self, process):
+        """Kill `process` and all processes it forked"""
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass  # All gone already
+
+    async def wait_killed(self, process):
+        """Wait up to `drain_timeout` seconds for the killed `process`, then
+        close its pipes, which a process that left its session may still
+        hold open"""
+        try:
+            await asyncio.wait_for(process.wait(), self.drain_timeout)
+        except asyncio.TimeoutError:
+            pass
+        # `Process` has no public way to close its transport
+        process._transport.close()
+
+    async def run_process_async(self, inp=""):
+        """Run the program with `inp`; return a `subprocess.CompletedProcess`"""
+        text = isinstance(inp, str)
+        # In a session of its own, so that a timeout also kills whatever
+        # the program forked and the pipes they hold get closed
+        process = await asyncio.create_subprocess_exec(
+            *self.args(), stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE, start_new_session=True)
+        stdout, stderr = TailBuffer(self.max_output), TailBuffer(self.max_output)
+        io = asyncio.gather(self.feed(process.stdin, inp.encode() if text else inp),
+                            self.capture(process.stdout, stdout),
+                            self.capture(process.stderr, stderr))
+        try:
+            await asyncio.wait_for(asyncio.shield(io), self.timeout)
+            returncode = await process.wait()
+        except asyncio.TimeoutError:
+            self.kill(process)
+            try:
+                await asyncio.wait_for(io, self.drain_timeout)
+            except asyncio.TimeoutError:
+                pass
+            await self.wait_killed(process)
+            returncode = -signal.SIGKILL
+        except asyncio.CancelledError:
+            self.kill(process)
+            io.cancel()
+            await asyncio.gather(io, return_exceptions=True)
+            await self.wait_killed(process)
+            raise
+
+        out, err = stdout.getvalue(), stderr.getvalue()
+        if text:
+            out = out.decode("utf-8", "replace")
+            err = err.decode("utf-8", "replace")
+        result = subprocess.CompletedProcess(self.args(), returncode, out, err)
+        result.stdout_size = stdout.total
+        result.stderr_size = stderr.total
+        return result
+
+    def run_process(self, inp=""):
+        return asyncio.run(self.run_process_async(inp))
+
+    async def run_many_async(self, inputs):
+        """Asynchronously yield `(inp, result, outcome)` for each of `inputs`
+        (an iterable, consumed lazily), in the order runs complete"""
+        inputs = iter(inputs)
+        done = asyncio.Queue(self.concurrency)
+        finished = object()
+
+        async def worker():
+            try:
+                for inp in inputs:
+                    result = await self.run_process_async(inp)
+                    await done.put((inp, result, self.outcome(result)))
+            except Exception as exc:
+                await done.put(exc)
+            else:
+                await done.put(finished)
+
+        workers = [asyncio.ensure_future(worker()) for i in range(self.concurrency)]
+        try:
+            running = len(workers)
+            while running:
+                item = await done.get()
+                if item is finished:
+                    running -= 1
+                elif isinstance(item, Exception):
+                    raise item
+                else:
+                    yield item
+        finally:
+            # Stop the remaining runs when the caller is done early
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+    def run_many(self, inputs):
+        """Yield `(inp, result, outcome)` for each of `inputs`, in the
+        order runs complete"""
+        loop = asyncio.new_event_loop()
+        results = self.run_many_async(inputs)
+        try:
+            while True:
+                try:
+                    yield loop.run_until_complete(results.__anext__())
+                except StopAsyncIteration:
+                    break
+        finally:
+            loop.run_until_complete(results.aclose())
+            loop.close()
+
+
+if __name__ == "__main__":
+    '''对比 ProgramRunner 顺序执行与并发进程池的吞吐量; 以及输出很多的目标下两者的内存峰值'''
+    import sys
+    import time
+    import tracemalloc
+
+    if __package__ is None or __package__ == "":
+        from nfuzz.Fuzzer import RandomFuzzer
+    else:
+        from .Fuzzer import RandomFuzzer
+
+    # A target that waits 50 ms, like one talking to a service
+    program = [sys.executable, "-c",
+               "import sys, time; time.sleep(0.05); print(len(sys.stdin.read()))"]
+    fuzzer = RandomFuzzer()
+    trials = 40
+    start = time.time()
+    for i in range(trials):
+        ProgramRunner(program).run(fuzzer.fuzz())
+    print("sequential:       %5.1f runs/s" % (trials / (time.time() - start)))
+    for concurrency in [4, 16]:
+        pool = ProgramRunnerPool(program, concurrency=concurrency)
+        start = time.time()
+        for inp, result, outcome in pool.run_many(fuzzer.fuzz() for i in range(trials)):
+            assert outcome == pool.PASS and result.stdout == "%d\n" % len(inp)
+        print("concurrency %2d:   %5.1f runs/s" % (concurrency, trials / (time.time() - start)))
+
+    # A chatty target: 50 MB of output
+    chatty = [sys.executable, "-c", "import sys; sys.stdout.write('x' * 50000000)"]
+    for runner in [ProgramRunner(chatty), ProgramRunnerPool(chatty)]:
+        tracemalloc.start()
+        result, outcome = runner.run("")
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print("%-18s kept %8d bytes, peak %6.1f MB" %
+              (type(runner).__name__, len(result.stdout), peak / 1e6))
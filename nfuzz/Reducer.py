@@ -0,0 +1,489 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8  -*-
+'''
+@author: sunqiao
+@contact: sunqiao@corp.netease.com
+@time: 2021/5/8 14:20
+@desc:Fuzzing with Grammers
+MIT License
+
+Copyright (c) 2021 alexqiaodan
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+import hashlib
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+if __package__ is None or __package__ == "":
+    from nfuzz.Fuzzer import Runner
+    from nfuzz.GrammarFuzzer import GrammarFuzzer, tree_to_string
+    from nfuzz.Grammars import START_SYMBOL
+    from nfuzz.Parser import EarleyParser
+    from nfuzz.TreeMutationFuzzer import IndexedTree
+else:
+    from .Fuzzer import Runner
+    from .GrammarFuzzer import GrammarFuzzer, tree_to_string
+    from .Grammars import START_SYMBOL
+    from .Parser import EarleyParser
+    from .TreeMutationFuzzer import IndexedTree
+
+
+def input_digest(inp):
+    """Return a short digest of `inp` (a string, bytes, or a sequence)"""
+    if isinstance(inp, str):
+        data = inp.encode("utf-8", "surrogatepass")
+    elif isinstance(inp, (bytes, bytearray)):
+        data = bytes(inp)
+    else:
+        data = repr(inp).encode("utf-8", "surrogatepass")
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+class Reducer(object):
+    """Base class for reducers.  A reducer shrinks a failing input while
+    the runner keeps returning the same outcome for it"""
+
+    def __init__(self, runner, log_test=False):
+        """Initialize.  `runner` is a `Runner` for the inputs"""
+        self.runner = runner
+        self.log_test = log_test
+        self.reset()
+
+    def reset(self):
+        """Forget all outcomes and statistics"""
+        self.outcomes = {}  # input digest -> outcome
+        self.tests = 0  # Inputs actually run
+        self.cache_hits = 0
+
+    def cached_outcome(self, inp):
+        """Return the outcome of `inp` if known, or None"""
+        outcome = self.outcomes.get(input_digest(inp))
+        if outcome is not None:
+            self.cache_hits += 1
+        return outcome
+
+    def record(self, inp, outcome):
+        """Count, log and cache a run of `inp` that gave `outcome`"""
+        self.tests += 1
+        if self.log_test:
+            print("Test #%d" % self.tests, repr(inp), repr(len(inp)), outcome)
+        self.outcomes[input_digest(inp)] = outcome
+
+    def run(self, inp):
+        """Run `inp` (not cached yet) and return its outcome"""
+        result, outcome = self.runner.run(inp)
+        self.record(inp, outcome)
+        return outcome
+
+    def test(self, inp):
+        """Return the outcome of `inp`, running it only once"""
+        outcome = self.cached_outcome(inp)
+        if outcome is None:
+            outcome = self.run(inp)
+        return outcome
+
+    def reduce(self, inp):
+        """Return a reduced version of `inp`"""
+        return inp
+
+
+class DeltaDebuggingReducer(Reducer):
+    """Reduce inputs with the ddmin algorithm, testing subsets and their
+    complements.
+
+    With `workers` > 1, the candidates of each round are tested in parallel
+    chunks of `workers` inputs, on a thread pool or on the given `executor`
+    (e.g. a `ProcessPoolExecutor` for picklable runners).  The first failing
+    candidate in ddmin order is taken, so the result is the same as with
+    sequential testing."""
+
+    def __init__(self, runner, log_test=False, workers=1, executor=None):
+        super().__init__(runner, log_test=log_test)
+        self.workers = workers
+        self.executor = executor
+
+    def first_failing(self, candidates, outcome):
+        """Return the first of the `candidates` (an iterable) with
+        `outcome`, or None.  Candidates after it are not generated."""
+        if self.workers <= 1:
+            for candidate in candidates:
+                if self.test(candidate) == outcome:
+                    return candidate
+            return None
+
+        candidates = iter(candidates)
+        executor = self.executor or ThreadPoolExecutor(self.workers)
+        try:
+            while True:
+                chunk = list(islice(candidates, self.workers))
+                if not chunk:
+                    return None
+                pending = {}  # digest -> (candidate, future), so duplicates run once
+                for candidate in chunk:
+                    digest = input_digest(candidate)
+                    if digest in pending:
+                        self.cache_hits += 1
+                    elif self.cached_outcome(candidate) is None:
+                        pending[digest] = (candidate,
+                                           executor.submit(self.runner.run, candidate))
+                # Same bookkeeping as `run()`, in candidate order
+                for candidate, future in pending.values():
+                    self.record(candidate, future.result()[1])
+                for candidate in chunk:
+                    if self.outcomes[input_digest(candidate)] == outcome:
+                        return candidate
+        finally:
+            if self.executor is None:
+                executor.shutdown()
+
+    def reduce(self, inp):
+        """Return a 1-minimal version of `inp` with the same outcome"""
+        outcome = self.test(inp)
+        n = 2  # Granularity
+        while len(inp) >= 2:
+            # Candidates are generated one at a time; with `n` close to
+            # `len(inp)`, all complements together would take O(len(inp)**2)
+            bounds = [len(inp) * i // n for i in range(n + 1)]
+            subsets = (inp[bounds[i]:bounds[i + 1]] for i in range(n))
+            complements = (inp[:bounds[i]] + inp[bounds[i + 1]:] for i in range(n))
+
+            # With two subsets, each subset is the other one's complement
+            reduced = self.first_failing(subsets, outcome) if n > 2 else None
+            if reduced is not None:
+                inp = reduced
+                n = 2
+                continue
+
+            reduced = self.first_failing(complements, outcome)
+            if reduced is not None:
+                inp = reduced
+                n = max(n - 1, 2)
+                continue
+
+            if n >= len(inp):
+                break
+            n = min(n * 2, len(inp))
+        return inp
+
+
+class Shifts(object):
+    """Where the offsets of a string are after some of its ranges were
+    replaced (a Fenwick tree over the original offsets)"""
+
+    def __init__(self, length):
+        self.sums = [0] * (length + 2)
+
+    def add(self, offset, delta):
+        """Move all original offsets >= `offset` by `delta`"""
+        sums = self.sums
+        i = offset + 1
+        while i < len(sums):
+            sums[i] += delta
+            i += i & -i
+
+    def at(self, offset):
+        """Return the current position of the original `offset`"""
+        sums = self.sums
+        i = offset + 1
+        while i > 0:
+            offset += sums[i]
+            i -= i & -i
+        return offset
+
+
+class GrammarReducer(Reducer):
+    """Reduce derivation trees level by level (hierarchical delta debugging).
+
+    Each subtree is replaced by the smallest alternative that keeps the
+    outcome: a smaller subtree for the same symbol found inside it, or the
+    minimum-cost expansion of the symbol.  All candidates are derivable from
+    `grammar`, so no test is wasted on syntactically invalid input.
+
+    A pass indexes the tree once and goes down its levels; replacements
+    only mark nodes as removed and record how offsets shift.  Passes repeat
+    until no subtree can be replaced."""
+
+    def __init__(self, runner, grammar, start_symbol=START_SYMBOL, log_test=False):
+        super().__init__(runner, log_test=log_test)
+        self.grammar = grammar
+        self.start_symbol = start_symbol
+        self.fuzzer = GrammarFuzzer(grammar, start_symbol=start_symbol)
+        self.parser = None  # Created on first `reduce()`
+        self.min_trees = {}  # symbol -> (tree, string)
+
+    def min_tree(self, symbol):
+        """Return `(tree, string)` of the minimum-cost expansion of `symbol`"""
+        if symbol not in self.min_trees:
+            tree = self.fuzzer.expand_tree_with_strategy(
+                (symbol, None), self.fuzzer.expand_node_min_cost)
+            self.min_trees[symbol] = (tree, tree_to_string(tree))
+        return self.min_trees[symbol]
+
+    def first_keeping(self, n, keeps):
+        """Return the index of one of `n` candidates, shortest first, for
+        which `keeps(index)` holds, or None.  Indexes 0, 1, 3, 7, ... are
+        tested first, then the gap before the first hit is bisected; if the
+        outcome only depends on a candidate being long enough, this finds
+        the shortest one with O(log n) tests."""
+        failed = -1
+        i = 0
+        while i < n:
+            if keeps(i):
+                break
+            failed = i
+            if i == n - 1:
+                return None
+            i = min(2 * i + 1, n - 1)
+        else:
+            return None
+
+        found = i
+        low, high = failed + 1, i - 1
+        while low <= high:
+            middle = (low + high) // 2
+            if keeps(middle):
+                found = middle
+                high = middle - 1
+            else:
+                low = middle + 1
+        return found
+
+    def reduce_tree(self, tree):
+        """Return a reduced version of the derivation tree `tree`"""
+        outcome = self.test(tree_to_string(tree))
+        while True:
+            reduced = self.reduce_levels(tree, outcome)
+            if reduced is None:
+                return tree
+            tree = reduced
+
+    def reduce_levels(self, tree, outcome):
+        """Reduce the nodes of `tree` level by level, keeping `outcome`.
+        Return the reduced tree, or None if no node could be replaced."""
+        indexed = IndexedTree(tree, self.grammar)
+        subtrees, starts, ends, stops = (indexed.subtrees, indexed.starts,
+                                         indexed.ends, indexed.stops)
+
+        depths = [0] * len(subtrees)
+        for number in range(1, len(subtrees)):
+            depths[number] = depths[indexed.parents[number]] + 1
+        levels = []  # depth -> grammar nodes, left to right
+        by_symbol = {}  # symbol -> grammar nodes, in preorder
+        for number in indexed.nodes:
+            while len(levels) <= depths[number]:
+                levels.append([])
+            levels[depths[number]].append(number)
+            by_symbol.setdefault(subtrees[number][0], []).append(number)
+
+        string = indexed.string
+        shifts = Shifts(len(string))
+        removed = bytearray(len(subtrees))
+        replaced = {}  # number -> number of a descendant, or a new subtree
+
+        for level in levels:
+            for number in level:
+                if removed[number]:
+                    continue
+                # Replace the node until no smaller alternative keeps the outcome
+                while True:
+                    symbol = subtrees[number][0]
+                    start = shifts.at(starts[number])
+                    length = ends[number] - starts[number]
+
+                    # (length, descendant); -1 is the minimum-cost expansion
+                    same = by_symbol[symbol]
+                    candidates = []
+                    for sub in same[bisect_right(same, number):
+                                    bisect_left(same, stops[number])]:
+                        if ends[sub] - starts[sub] < length:
+                            candidates.append((ends[sub] - starts[sub], sub))
+                    min_tree, min_string = self.min_tree(symbol)
+                    if len(min_string) < length:
+                        candidates.append((len(min_string), -1))
+                    candidates.sort()
+
+                    def candidate_string(i):
+                        sub_length, sub = candidates[i]
+                        if sub < 0:
+                            middle = min_string
+                        else:
+                            sub_start = shifts.at(starts[sub])
+                            middle = string[sub_start:sub_start + sub_length]
+                        return string[:start] + middle + string[start + length:]
+
+                    i = self.first_keeping(
+                        len(candidates),
+                        lambda i: self.test(candidate_string(i)) == outcome)
+                    if i is None:
+                        break
+
+                    string = candidate_string(i)
+                    sub_length, sub = candidates[i]
+                    if sub < 0:
+                        replaced[number] = min_tree
+                        removed[number:stops[number]] = b"\x01" * (stops[number] - number)
+                        shifts.add(ends[number], sub_length - length)
+                        break
+
+                    replaced[number] = sub
+                    removed[number:sub] = b"\x01" * (sub - number)
+                    removed[stops[sub]:stops[number]] = b"\x01" * (stops[number] - stops[sub])
+                    shifts.add(starts[sub], starts[number] - starts[sub])
+                    shifts.add(ends[number], ends[sub] - ends[number])
+                    number = sub
+
+        if not replaced:
+            return None
+        return self.rebuild(indexed, replaced)
+
+    def rebuild(self, indexed, replaced):
+        """Return the tree of `indexed` with the `replaced` nodes substituted.
+        Only the ancestors of replaced nodes are copied."""
+        spine = set()
+        for number in replaced:
+            while number >= 0 and number not in spine:
+                spine.add(number)
+                number = indexed.parents[number]
+
+        # Descendants have higher numbers, so they are built first
+        built = {}
+        for number in sorted(spine, reverse=True):
+            if number in replaced:
+                new = replaced[number]
+                if isinstance(new, int):
+                    new = built.get(new, indexed.subtrees[new])
+                built[number] = new
+                continue
+            symbol, children = indexed.subtrees[number][0], indexed.subtrees[number][1]
+            children = list(children)
+            child = number + 1
+            while child < indexed.stops[number]:
+                if child in built:
+                    children[indexed.slots[child]] = built[child]
+                child = indexed.stops[child]
+            built[number] = (symbol, children)
+        return built[0]
+
+    def reduce(self, inp):
+        """Parse `inp` with `grammar` and return a reduced version of it"""
+        if self.parser is None:
+            self.parser = EarleyParser(self.grammar, self.start_symbol)
+        return tree_to_string(self.reduce_tree(self.parser.parse(inp)))
+
+
+if __name__ == "__main__":
+    '''用 ddmin 缩减一个 100 KB 的失败输入, 对比顺序与并行 (线程池) 测试; 再对比 ddmin 与基于派生树的层次化缩减的测试次数'''
+    import random
+    import time
+
+    if __package__ is None or __package__ == "":
+        from nfuzz.Fuzzer import ProgramRunner, random_string
+        from nfuzz.MutationFuzzer import FunctionRunner
+    else:
+        from .Fuzzer import ProgramRunner, random_string
+        from .MutationFuzzer import FunctionRunner
+
+    def mystery(inp):
+        # Fails on "<" ... ">" with a "!" somewhere in between
+        start = inp.find("<")
+        if start >= 0 and "!" in inp[start:inp.find(">", start) + 1]:
+            raise ValueError("Invalid markup")
+
+    random.seed(0)
+    failing = (random_string(50000, ord("a"), 26) + "<a!" +
+               random_string(50000, ord("a"), 26) + ">")
+    print(FunctionRunner(mystery).run(failing)[1])
+
+    reducer = DeltaDebuggingReducer(FunctionRunner(mystery))
+    start = time.time()
+    reduced = reducer.reduce(failing)
+    print("%d -> %r: %d tests, %d cache hits, %.2fs" %
+          (len(failing), reduced, reducer.tests, reducer.cache_hits,
+           time.time() - start))
+
+    # Each test of a program costs a process start; run them in parallel
+    checker = ["python3", "-c",
+               "import sys, os; s = sys.stdin.read(); "
+               "i = s.find('<'); "
+               "os.abort() if i >= 0 and '!' in s[i:s.find('>', i) + 1] else None"]
+    small = "xyz<a!bc>uvw" * 2
+    for workers in [1, 4]:
+        reducer = DeltaDebuggingReducer(ProgramRunner(checker), workers=workers)
+        start = time.time()
+        reduced = reducer.reduce(small)
+        print("%d workers: %r, %d tests, %.2fs" %
+              (workers, reduced, reducer.tests, time.time() - start))
+
+    # On structured input, reducing the derivation tree needs fewer tests
+    # than ddmin, which mostly produces syntax errors
+    if __package__ is None or __package__ == "":
+        from nfuzz.Grammars import EXPR_GRAMMAR
+    else:
+        from .Grammars import EXPR_GRAMMAR
+
+    class EvalRunner(Runner):
+        def run(self, inp):
+            try:
+                eval(inp)
+            except ZeroDivisionError:
+                return None, self.FAIL
+            except Exception:
+                return None, self.UNRESOLVED
+            return None, self.PASS
+
+    random.seed(3)
+    fuzzer = GrammarFuzzer(EXPR_GRAMMAR, min_nonterminals=100, max_nonterminals=400)
+    while True:
+        tree = fuzzer.fuzz_tree()
+        failing = tree_to_string(tree)
+        if len(failing) > 300 and EvalRunner().run(failing)[1] == Runner.FAIL:
+            break
+
+    for reducer in [DeltaDebuggingReducer(EvalRunner()),
+                    GrammarReducer(EvalRunner(), EXPR_GRAMMAR)]:
+        start = time.time()
+        reduced = reducer.reduce(failing)
+        print("%-21s %d -> %r: %d tests, %.2fs" %
+              (type(reducer).__name__, len(failing), reduced, reducer.tests,
+               time.time() - start))
+
+    # Deep, right-recursive derivation trees
+    if __package__ is None or __package__ == "":
+        from nfuzz.Grammars import CGI_GRAMMAR
+    else:
+        from .Grammars import CGI_GRAMMAR
+
+    def cgi_mystery(inp):
+        if "%4" in inp and "++" in inp:
+            raise ValueError("Invalid query")
+
+    letters = GrammarFuzzer(CGI_GRAMMAR, start_symbol="<letter>")
+    failing = ""
+    while len(failing) < 8000 or FunctionRunner(cgi_mystery).run(failing)[1] != Runner.FAIL:
+        failing += letters.fuzz()
+
+    for reducer in [DeltaDebuggingReducer(FunctionRunner(cgi_mystery)),
+                    GrammarReducer(FunctionRunner(cgi_mystery), CGI_GRAMMAR)]:
+        start = time.time()
+        reduced = reducer.reduce(failing)
+        print("%-21s %d -> %r: %d tests, %.2fs" %
+              (type(reducer).__name__, len(failing), reduced, reducer.tests,
+               time.time() - start))
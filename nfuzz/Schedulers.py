@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8  -*-
+'''
+@author: sunqiao
+@contact: sunqiao@corp.netease.com
+@time: 2021/4/27 11:05
+@desc:Fuzzing with Grammers
+MIT License
+
+Copyright (c) 2021 alexqiaodan
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+import math
+import random
+
+
+class FenwickTree(object):
+    """A list of non-negative weights supporting `append()`, `set()` and
+    weighted sampling in O(log n)"""
+
+    def __init__(self, values=()):
+        self.values = list(values)
+        self._build()
+
+    def _build(self):
+        n = len(self.values)
+        tree = [0.0] + [float(value) for value in self.values]
+        for i in range(1, n + 1):
+            j = i + (i & -i)
+            if j <= n:
+                tree[j] += tree[i]
+        self.tree = tree
+        # Updates add rounding errors; rebuilding now and then keeps
+        # them small at amortized O(1) cost
+        self._updates_left = max(1024, 4 * n)
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, i):
+        return self.values[i]
+
+    def prefix_sum(self, i):
+        """The sum of the first `i` weights"""
+        tree = self.tree
+        total = 0.0
+        while i > 0:
+            total += tree[i]
+            i -= i & -i
+        return total
+
+    def total(self):
+        return self.prefix_sum(len(self.values))
+
+    def append(self, value):
+        self.values.append(value)
+        n = len(self.values)
+        # tree[n] holds the sum of the weights (n - lowbit(n), n]
+        self.tree.append(value + self.prefix_sum(n - 1) - self.prefix_sum(n - (n & -n)))
+
+    def set(self, i, value):
+        """Set the `i`-th weight (counting from 0) to `value`"""
+        delta = value - self.values[i]
+        self.values[i] = value
+        self._updates_left -= 1
+        if self._updates_left <= 0:
+            self._build()
+            return
+        tree = self.tree
+        n = len(self.values)
+        i += 1
+        while i <= n:
+            tree[i] += delta
+            i += i & -i
+
+    def find(self, x):
+        """The index of the weight in which the running sum passes `x`"""
+        tree = self.tree
+        n = len(self.values)
+        position = 0
+        step = 1 << n.bit_length()
+        while step > 0:
+            if position + step <= n and tree[position + step] <= x:
+                position += step
+                x -= tree[position]
+            step >>= 1
+        return min(position, n - 1)
+
+    def sample(self):
+        """A random index, chosen with probability proportional to its weight"""
+        return self.find(random.random() * self.total())
+
+
+class PowerSchedule(object):
+    """Assign energy to the seeds of a population; seeds are chosen with
+    probability proportional to their energy.  This one gives all seeds
+    the same energy."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.weights = FenwickTree()
+        self.paths = []  # seed index -> path id, or None if not run yet
+
+    def energy(self, index):
+        """The energy of the seed `index`"""
+        return 1.0
+
+    def add_seed(self, path=None):
+        """Add a seed that exercised `path`; return its index"""
+        index = len(self.paths)
+        self.paths.append(path)
+        self.weights.append(self.energy(index))
+        return index
+
+    def set_path(self, index, path):
+        """Record that the seed `index` exercises `path`"""
+        self.paths[index] = path
+        self.weights.set(index, self.energy(index))
+
+    def path_exercised(self, path):
+        """Called whenever an input exercised `path`"""
+        pass
+
+    def choose(self):
+        """Return the index of the seed to fuzz next"""
+        return random.randrange(0, len(self.paths))
+
+
+class AFLFastSchedule(PowerSchedule):
+    """Exponential schedule (AFLFast): the energy of a seed is
+    1 / f ** `exponent`, where f is the number of times its path was exercised"""
+
+    def __init__(self, exponent=5):
+        self.exponent = exponent
+        super().__init__()
+
+    def reset(self):
+        super().reset()
+        self.path_frequency = {}
+        self.seeds_by_path = {}
+
+    def energy(self, index):
+        frequency = self.path_frequency.get(self.paths[index], 0)
+        return 1.0 / max(frequency, 1) ** self.exponent
+
+    def add_seed(self, path=None):
+        index = super().add_seed(path)
+        self.seeds_by_path.setdefault(path, []).append(index)
+        return index
+
+    def set_path(self, index, path):
+        self.seeds_by_path[self.paths[index]].remove(index)
+        self.seeds_by_path.setdefault(path, []).append(index)
+        super().set_path(index, path)
+
+    def path_exercised(self, path):
+        self.path_frequency[path] = self.path_frequency.get(path, 0) + 1
+        # Only the seeds on this path change their energy
+        for index in self.seeds_by_path.get(path, []):
+            self.weights.set(index, self.energy(index))
+
+    def choose(self):
+        return self.weights.sample()
+
+
+class RecencySchedule(PowerSchedule):
+    """Prefer recently added seeds: the energy of a seed halves with every
+    `half_life` seeds added after it"""
+
+    # Rescale before energies overflow; old seeds may drop to 0 then
+    MAX_EXPONENT = 512
+
+    def __init__(self, half_life=100):
+        self.half_life = half_life
+        super().__init__()
+
+    def reset(self):
+        super().reset()
+        self.offset = 0  # Subtracted from all exponents
+
+    def energy(self, index):
+        return 2.0 ** (index / self.half_life - self.offset)
+
+    def add_seed(self, path=None):
+        if len(self.paths) / self.half_life - self.offset > self.MAX_EXPONENT:
+            # Rare: after every `MAX_EXPONENT * half_life` seeds
+            self.offset += self.MAX_EXPONENT
+            self.weights = FenwickTree(self.energy(i) for i in range(len(self.paths)))
+        return super().add_seed(path)
+
+    def choose(self):
+        return self.weights.sample()
+
+
+class Bandit(object):
+    """Choose among `arms`, learning from rewards which ones succeed.
+    This one chooses uniformly."""
+
+    def __init__(self, arms):
+        self.arms = list(arms)
+        self.uses = [0] * len(self.arms)
+        self.successes = [0] * len(self.arms)
+        self.total = 0
+
+    def choose(self):
+        """Return the index of the arm to use next"""
+        return random.randrange(0, len(self.arms))
+
+    def reward(self, index, success):
+        """Record whether using the arm `index` was a success"""
+        self.uses[index] += 1
+        self.successes[index] += bool(success)
+        self.total += 1
+
+    def stats(self):
+        """Per-arm statistics, as a list of dicts"""
+        return [{"arm": getattr(arm, "__name__", arm),
+                 "uses": self.uses[i],
+                 "successes": self.successes[i],
+                 "rate": self.successes[i] / self.uses[i] if self.uses[i] else None}
+                for (i, arm) in enumerate(self.arms)]
+
+
+class UCBBandit(Bandit):
+    """UCB1: choose the arm with the highest upper confidence bound of its
+    success rate"""
+
+    def __init__(self, arms, exploration=1.0):
+        super().__init__(arms)
+        self.exploration = exploration
+
+    def choose(self):
+        uses = self.uses
+        if 0 in uses:
+            return uses.index(0)
+        log_total = math.log(self.total)
+        bounds = [self.successes[i] / uses[i] +
+                  self.exploration * math.sqrt(2 * log_total / uses[i])
+                  for i in range(len(uses))]
+        return bounds.index(max(bounds))
+
+
+class ThompsonBandit(Bandit):
+    """Thompson sampling: draw a success rate for every arm from its
+    Beta posterior and choose the highest"""
+
+    def choose(self):
+        draws = [random.betavariate(1 + self.successes[i],
+                                    1 + self.uses[i] - self.successes[i])
+                 for i in range(len(self.arms))]
+        return draws.index(max(draws))
+
+
+class MutatorScheduler(object):
+    """Choose mutators and the number of mutations stacked per candidate
+    with bandits.  A candidate is a success if it found new coverage or a
+    new outcome; all mutators used for it, and its depth, share the reward."""
+
+    def __init__(self, mutators, depths=None, bandit=UCBBandit):
+        """`depths` are the numbers of mutations to choose from; if None,
+        the fuzzer sets them from its `min_mutations` and `max_mutations`"""
+        self.bandit = bandit
+        self.mutators = bandit(mutators)
+        self.depths = None
+        if depths is not None:
+            self.set_depths(depths)
+        self.used = []  # Mutators used for the current candidate
+        self.depth = None  # Depth arm of the current candidate
+
+    def set_depths(self, depths):
+        self.depths = self.bandit(depths)
+
+    def choose_depth(self):
+        """Start a new candidate; return the number of mutations to apply"""
+        self.depth = self.depths.choose()
+        self.used = []
+        return self.depths.arms[self.depth]
+
+    def choose_mutator(self):
+        index = self.mutators.choose()
+        self.used.append(index)
+        return self.mutators.arms[index]
+
+    def reward(self, success):
+        """Record whether the current candidate was a success"""
+        if self.depth is None:
+            return
+        for index in set(self.used):
+            self.mutators.reward(index, success)
+        self.depths.reward(self.depth, success)
+        self.depth = None
+
+    def stats(self):
+        return {"mutators": self.mutators.stats(),
+                "depths": self.depths.stats() if self.depths is not None else []}
+
+
+if __name__ == "__main__":
+    '''大种群下的选种开销：Fenwick 树增量更新 vs 每次重建权重列表'''
+    import time
+
+    population = 50000
+    trials = 2000
+    random.seed(0)
+
+    schedule = AFLFastSchedule()
+    for i in range(population):
+        schedule.add_seed(path=i % 5000)
+
+    start_time = time.time()
+    for i in range(trials):
+        schedule.choose()
+        schedule.path_exercised(random.randrange(0, 5000))
+    elapsed = time.time() - start_time
+    print("AFLFastSchedule, %d seeds: %8.1f us per choice" %
+          (population, elapsed / trials * 1e6))
+
+    start_time = time.time()
+    for i in range(trials // 10):
+        weights = [schedule.energy(index) for index in range(population)]
+        random.choices(range(population), weights=weights)
+    elapsed = time.time() - start_time
+    print("O(n) rebuild,    %d seeds: %8.1f us per choice" %
+          (population, elapsed / (trials // 10) * 1e6))
+
+    # The Fenwick tree samples as `random.choices()` does
+    tree = FenwickTree([1, 0, 3, 6])
+    counts = [0] * 4
+    for i in range(100000):
+        counts[tree.sample()] += 1
+    print("weights [1, 0, 3, 6] sampled as", [round(c / 100000, 2) for c in counts])
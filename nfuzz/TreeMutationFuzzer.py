@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8  -*-
+'''
+@author: sunqiao
+@contact: sunqiao@corp.netease.com
+@time: 2021/4/29 15:20
+@desc:Fuzzing with Grammers
+MIT License
+
+Copyright (c) 2021 alexqiaodan
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+import random
+from array import array
+
+if __package__ is None or __package__ == "":
+    from nfuzz.Fuzzer import Fuzzer, Runner
+    from nfuzz.Grammars import START_SYMBOL, is_nonterminal
+    from nfuzz.GrammarFuzzer import GrammarFuzzer, tree_to_string
+else:
+    from .Fuzzer import Fuzzer, Runner
+    from .Grammars import START_SYMBOL, is_nonterminal
+    from .GrammarFuzzer import GrammarFuzzer, tree_to_string
+
+
+class FragmentPool(object):
+    """Subtrees of derivation trees, indexed by their nonterminal symbol.
+    At most `max_fragments` are kept per symbol; once full, each new
+    fragment replaces a random one (reservoir sampling), so that the pool
+    stays a uniform sample of all fragments seen."""
+
+    def __init__(self, max_fragments=100):
+        self.max_fragments = max_fragments
+        self.fragments = {}  # symbol -> list of (subtree, string)
+        self.strings = {}  # symbol -> set of fragment strings
+        self.seen = {}  # symbol -> number of fragments offered
+
+    def add(self, symbol, subtree, string):
+        """Offer `subtree`, deriving `string`, as a fragment for `symbol`"""
+        strings = self.strings.setdefault(symbol, set())
+        if string in strings:
+            return
+        fragments = self.fragments.setdefault(symbol, [])
+        seen = self.seen[symbol] = self.seen.get(symbol, 0) + 1
+        if len(fragments) < self.max_fragments:
+            fragments.append((subtree, string))
+            strings.add(string)
+            return
+        j = random.randrange(0, seen)
+        if j < self.max_fragments:
+            strings.discard(fragments[j][1])
+            fragments[j] = (subtree, string)
+            strings.add(string)
+
+    def choose(self, symbol):
+        """Return a random `(subtree, string)` for `symbol`, or None"""
+        fragments = self.fragments.get(symbol)
+        if not fragments:
+            return None
+        return fragments[random.randrange(0, len(fragments))]
+
+    def __len__(self):
+        return sum(len(fragments) for fragments in self.fragments.values())
+
+
+class IndexedTree(object):
+    """A derivation tree with its string.  Its expanded nodes are numbered
+    in preorder, so the subtree of node `n` holds the numbers
+    `n` ... `stops[n] - 1`.  Flat arrays hold, for each node, its parent
+    (-1 for the root), its slot in the parent's children, and the offsets
+    of its string; `nodes` lists the nodes expanding a grammar symbol.
+    Paths are only built on demand, by `path()`."""
+
+    def __init__(self, tree, grammar):
+        self.tree = tree
+        self.subtrees = []  # number -> node
+        self.parents = array('l')
+        self.slots = array('l')
+        self.starts = array('l')
+        self.ends = array('l')
+        self.stops = array('l')  # number -> number after its subtree
+        self.nodes = array('l')  # numbers of grammar nonterminal nodes
+        strings = []
+        position = 0
+
+        # Preorder; `node` None marks the end of the subtree of `parent`
+        stack = [(tree, -1, 0)]
+        while stack:
+            node, parent, slot = stack.pop()
+            if node is None:
+                self.ends[parent] = position
+                self.stops[parent] = len(self.subtrees)
+                continue
+            symbol, children = node[0], node[1]
+            if children is not None and (children or symbol in grammar):
+                number = len(self.subtrees)
+                self.subtrees.append(node)
+                self.parents.append(parent)
+                self.slots.append(slot)
+                self.starts.append(position)
+                self.ends.append(position)
+                self.stops.append(number + 1)
+                if symbol in grammar:
+                    self.nodes.append(number)
+                stack.append((None, number, 0))
+                for i in range(len(children) - 1, -1, -1):
+                    stack.append((children[i], number, i))
+            elif not is_nonterminal(symbol):
+                strings.append(symbol)
+                position += len(symbol)
+        self.string = ''.join(strings)
+
+    def subtree(self, number):
+        return self.subtrees[number]
+
+    def span(self, number):
+        """Return the `(start, end)` offsets of the string of node `number`"""
+        return self.starts[number], self.ends[number]
+
+    def path(self, number):
+        """Return the child indexes leading from the root to node `number`"""
+        path = []
+        while self.parents[number] >= 0:
+            path.append(self.slots[number])
+            number = self.parents[number]
+        return tuple(reversed(path))
+
+    def replace(self, number, subtree):
+        """Return a new tree with node `number` replaced by `subtree`.
+        Only the nodes on its path are copied; all others are shared."""
+        new = subtree
+        while self.parents[number] >= 0:
+            parent = self.parents[number]
+            symbol, children = self.subtrees[parent][0], self.subtrees[parent][1]
+            children = list(children)
+            children[self.slots[number]] = new
+            new = (symbol, children)
+            number = parent
+        return new
+
+
+class TreeMutationFuzzer(Fuzzer):
+    """Produce inputs by replacing a random subtree of a derivation tree
+    from the population with a fragment of the same nonterminal, taken
+    from a `FragmentPool` or freshly generated.  All results are derivable
+    from `grammar`.  With a runner that has `coverage()` (e.g. a
+    `FunctionCoverageRunner`), passing inputs that cover new branches are
+    added to the population, and their subtrees to the pool.  Trees are
+    shared with the population and the pool, so they must not be changed
+    in place."""
+
+    def __init__(self, grammar, start_symbol=START_SYMBOL, seeds=None, population_size=20,
+                 max_fragments=100, fresh_probability=0.2,
+                 min_nonterminals=0, max_nonterminals=10):
+        """Mutate the derivation trees in `seeds`; if None, generate
+        `population_size` trees with a `GrammarFuzzer`.  With probability
+        `fresh_probability`, or if no fragment exists, a subtree is replaced
+        by a new one expanded within `min_nonterminals`/`max_nonterminals`."""
+        self.grammar = grammar
+        self.start_symbol = start_symbol
+        self.fresh_probability = fresh_probability
+        self.generator = GrammarFuzzer(grammar, start_symbol=start_symbol,
+                                       min_nonterminals=min_nonterminals,
+                                       max_nonterminals=max_nonterminals)
+        self.pool = FragmentPool(max_fragments)
+        self.population = []
+        self.total_coverage = set()
+        if seeds is None:
+            seeds = [self.generator.fuzz_tree() for i in range(population_size)]
+        for tree in seeds:
+            self.add_tree(tree)
+
+    def add_tree(self, tree):
+        """Add `tree` to the population, and its subtrees to the pool"""
+        indexed = IndexedTree(tree, self.grammar)
+        self.population.append(indexed)
+        for number in indexed.nodes:
+            subtree = indexed.subtrees[number]
+            start, end = indexed.span(number)
+            self.pool.add(subtree[0], subtree, indexed.string[start:end])
+        return indexed
+
+    def fresh_fragment(self, symbol):
+        subtree = self.generator.expand_tree((symbol, None))
+        string = tree_to_string(subtree)
+        self.pool.add(symbol, subtree, string)
+        return subtree, string
+
+    def mutate(self):
+        """Return `(tree, string)` for a new input"""
+        indexed = self.population[random.randrange(0, len(self.population))]
+        number = indexed.nodes[random.randrange(0, len(indexed.nodes))]
+        symbol = indexed.subtrees[number][0]
+        start, end = indexed.span(number)
+
+        fragment = None
+        if random.random() >= self.fresh_probability:
+            fragment = self.pool.choose(symbol)
+        if fragment is None:
+            fragment = self.fresh_fragment(symbol)
+        subtree, string = fragment
+
+        return (indexed.replace(number, subtree),
+                indexed.string[:start] + string + indexed.string[end:])
+
+    def fuzz_tree(self):
+        self.derivation_tree, self.inp = self.mutate()
+        return self.derivation_tree
+
+    def fuzz(self):
+        self.derivation_tree, self.inp = self.mutate()
+        return self.inp
+
+    def run(self, runner=Runner()):
+        """Run `runner` with fuzz input; keep its tree if it covers new branches"""
+        result, outcome = super().run(runner)
+        if hasattr(runner, "coverage"):
+            new_coverage = runner.coverage() - self.total_coverage
+            if new_coverage:
+                self.total_coverage |= new_coverage
+                if outcome == Runner.PASS:
+                    self.add_tree(self.derivation_tree)
+        return (result, outcome)
+
+
+if __name__ == "__main__":
+    '''对比从头生成 (GrammarFuzzer) 与派生树变异/拼接的生成速度'''
+    import time
+
+    if __package__ is None or __package__ == "":
+        from nfuzz.Grammars import EXPR_GRAMMAR
+    else:
+        from .Grammars import EXPR_GRAMMAR
+
+    random.seed(0)
+    trials = 1000
+    generator = GrammarFuzzer(EXPR_GRAMMAR, min_nonterminals=50, max_nonterminals=200)
+
+    start_time = time.time()
+    trees = [generator.fuzz_tree() for i in range(trials)]
+    elapsed = time.time() - start_time
+    print("GrammarFuzzer      %8.0f inputs/s, %6.0f characters on average" %
+          (trials / elapsed, sum(len(tree_to_string(tree)) for tree in trees) / trials))
+
+    fuzzer = TreeMutationFuzzer(EXPR_GRAMMAR, seeds=trees[:20])
+    start_time = time.time()
+    inputs = [fuzzer.fuzz() for i in range(trials * 10)]
+    elapsed = time.time() - start_time
+    print("TreeMutationFuzzer %8.0f inputs/s, %6.0f characters on average, %d fragments" %
+          (trials * 10 / elapsed, sum(len(inp) for inp in inputs) / len(inputs),
+           len(fuzzer.pool)))
+
+    # Every mutated tree derives the string returned for it
+    for i in range(100):
+        tree = fuzzer.fuzz_tree()
+        assert tree_to_string(tree) == fuzzer.inp
+
+
+if __name__ == "__main__":
+    '''覆盖率引导：覆盖新分支的变异结果加入种群与片段池'''
+    if __package__ is None or __package__ == "":
+        from nfuzz.Grammars import EXPR_GRAMMAR
+        from nfuzz.MutationFuzzer import FunctionCoverageRunner
+    else:
+        from .Grammars import EXPR_GRAMMAR
+        from .MutationFuzzer import FunctionCoverageRunner
+
+    def calculate(inp):
+        depth = 0
+        for c in inp:
+            if c == '(':
+                depth += 1
+            elif c == ')':
+                depth -= 1
+            elif c in '+-':
+                if depth > 2:
+                    pass
+            elif c in '*/':
+                if depth > 1:
+                    pass
+            elif c == '.':
+                pass
+        return eval(inp)
+
+    random.seed(0)
+    fuzzer = TreeMutationFuzzer(EXPR_GRAMMAR, population_size=5)
+    runner = FunctionCoverageRunner(calculate)
+    for i in range(300):
+        fuzzer.run(runner)
+    print("%d trees in the population, %d fragments, %d branches covered" %
+          (len(fuzzer.population), len(fuzzer.pool), len(fuzzer.total_coverage)))
+    assert len(fuzzer.population) > 5
@@ -27,9 +27,10 @@ LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 '''
+import asyncio
+import ssl
 import time
 
-import requests
 import string
 from http.server import BaseHTTPRequestHandler
 from http import HTTPStatus
@@ -39,7 +40,7 @@ if __package__ is None or __package__ == "":
 else:
     pass
 import urllib.parse
-from urllib.parse import urljoin
+from urllib.parse import urljoin, urlsplit
 import traceback
 from html.parser import HTMLParser
 if __package__ is None or __package__ == "":
@@ -220,12 +221,207 @@ class WebRunner(Runner):
 
         import requests  # for imports
         r = requests.get(url)
-        if r.status_code == HTTPStatus.OK:
-            return url, Runner.PASS
-        elif r.status_code == HTTPStatus.INTERNAL_SERVER_ERROR:
-            return url, Runner.FAIL
+        return url, self.outcome(r.status_code)
+
+    def outcome(self, status_code):
+        if status_code == HTTPStatus.OK:
+            return Runner.PASS
+        elif status_code == HTTPStatus.INTERNAL_SERVER_ERROR:
+            return Runner.FAIL
+        else:
+            return Runner.UNRESOLVED
+
+
+class AsyncWebRunner(WebRunner):
+    """A `WebRunner` on asyncio streams, keeping connections alive.
+
+    Idle connections are pooled per host (up to `max_idle` each) and
+    reused by later requests; `run_many()` runs up to `concurrency`
+    requests at a time.  Redirects are followed, as with `requests.get()`.
+    A request not done within `timeout` seconds, or failing on the
+    network, is UNRESOLVED."""
+
+    MAX_REDIRECTS = 30
+    REDIRECTS = {301, 302, 303, 307, 308}
+    # Characters left as they are in request targets (like `requests`)
+    SAFE = "!#$%&'()*+,/:;=?@[]~"
+
+    def __init__(self, base_url=None, concurrency=10, timeout=10.0, max_idle=None):
+        super().__init__(base_url)
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.max_idle = max_idle or concurrency
+        self.idle = {}  # (scheme, host, port) -> [(reader, writer)]
+        self.connections = 0  # Connections opened so far
+        self.loop = None
+
+    async def connect(self, key):
+        scheme, host, port = key
+        context = ssl.create_default_context() if scheme == "https" else None
+        connection = await asyncio.open_connection(host, port, ssl=context)
+        self.connections += 1
+        return connection
+
+    def release(self, key, connection, keep_alive):
+        idle = self.idle.setdefault(key, [])
+        if keep_alive and len(idle) < self.max_idle:
+            idle.append(connection)
+        else:
+            connection[1].close()
+
+    def drop_idle(self, key):
+        for reader, writer in self.idle.pop(key, []):
+            writer.close()
+
+    async def request(self, connection, host, target):
+        """Send a GET request; return `(status, headers, keep_alive)` once
+        the whole response is read"""
+        reader, writer = connection
+        writer.write(("GET %s HTTP/1.1\r\nHost: %s\r\nAccept: */*\r\n"
+                      "Connection: keep-alive\r\n\r\n" % (target, host)).encode("latin-1"))
+        await writer.drain()
+
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError("connection closed by server")
+        version, status = status_line.split(None, 2)[:2]
+        status = int(status)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        connection_header = headers.get("connection", "").lower()
+        keep_alive = (connection_header != "close" if version == b"HTTP/1.1"
+                      else connection_header == "keep-alive")
+        if status < 200 or status in (204, 304):
+            pass  # No body
+        elif headers.get("transfer-encoding", "").lower() == "chunked":
+            while True:
+                size = int((await reader.readline()).split(b";")[0], 16)
+                if size == 0:
+                    break
+                await reader.readexactly(size + 2)  # With CRLF
+            # Trailer fields, up to an empty line
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+        elif "content-length" in headers:
+            await reader.readexactly(int(headers["content-length"]))
         else:
+            while await reader.read(65536):
+                pass
+            keep_alive = False
+        return status, headers, keep_alive
+
+    async def get(self, url):
+        """Return the status code of GET `url`, after redirects"""
+        for redirect in range(self.MAX_REDIRECTS + 1):
+            parts = urlsplit(url)
+            port = parts.port or (443 if parts.scheme == "https" else 80)
+            key = (parts.scheme, parts.hostname, port)
+            host = parts.hostname if parts.port is None else "%s:%d" % (parts.hostname, port)
+            target = urllib.parse.quote(parts.path or "/", safe=self.SAFE)
+            if parts.query:
+                target += "?" + urllib.parse.quote(parts.query, safe=self.SAFE)
+
+            for attempt in range(2):
+                idle = self.idle.get(key)
+                reused = attempt == 0 and bool(idle)
+                connection = idle.pop() if reused else await self.connect(key)
+                try:
+                    status, headers, keep_alive = await self.request(connection, host, target)
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    connection[1].close()
+                    if reused:
+                        # The server closed the idle connection, and likely
+                        # the other idle ones too: retry on a new one
+                        self.drop_idle(key)
+                        continue
+                    raise
+                except BaseException:
+                    connection[1].close()
+                    raise
+                break
+            else:
+                raise ConnectionResetError("no connection to %s:%d" % key[1:])
+            self.release(key, connection, keep_alive)
+
+            if status not in self.REDIRECTS or "location" not in headers:
+                break
+            url = urljoin(url, headers["location"])
+        return status
+
+    async def run_async(self, url):
+        if self.base_url is not None:
+            url = urljoin(self.base_url, url)
+        try:
+            status = await asyncio.wait_for(self.get(url), self.timeout)
+        except (OSError, ValueError, asyncio.TimeoutError, asyncio.IncompleteReadError):
             return url, Runner.UNRESOLVED
+        return url, self.outcome(status)
+
+    def get_loop(self):
+        if self.loop is None:
+            self.loop = asyncio.new_event_loop()
+        return self.loop
+
+    def run(self, url):
+        return self.get_loop().run_until_complete(self.run_async(url))
+
+    async def run_many_async(self, urls):
+        urls = iter(urls)
+        done = asyncio.Queue(self.concurrency)
+        finished = object()
+
+        async def worker():
+            try:
+                for url in urls:
+                    await done.put(await self.run_async(url))
+            except Exception as exc:
+                await done.put(exc)
+            else:
+                await done.put(finished)
+
+        workers = [asyncio.ensure_future(worker()) for i in range(self.concurrency)]
+        try:
+            running = len(workers)
+            while running:
+                item = await done.get()
+                if item is finished:
+                    running -= 1
+                elif isinstance(item, Exception):
+                    raise item
+                else:
+                    yield item
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+    def run_many(self, urls):
+        """Yield `(url, outcome)` for each of `urls`, in the order the
+        requests complete"""
+        loop = self.get_loop()
+        results = self.run_many_async(urls)
+        try:
+            while True:
+                try:
+                    yield loop.run_until_complete(results.__anext__())
+                except StopAsyncIteration:
+                    break
+        finally:
+            loop.run_until_complete(results.aclose())
+
+    def close(self):
+        """Close all idle connections"""
+        for key in list(self.idle):
+            self.drop_idle(key)
+        if self.loop is not None:
+            self.loop.close()
+            self.loop = None
 
 
 class FormHTMLParser(HTMLParser):
@@ -364,12 +560,108 @@ class WebFormFuzzer(GrammarFuzzer):
         super().__init__(grammar, **grammar_fuzzer_options)
 
     def get_html(self, url):
+        import requests  # Only needed here
         return requests.get(url).text
 
     def get_grammar(self, html_text):
         grammar_miner = HTMLGrammarMiner(html_text)
         return grammar_miner.mine_grammar()
 
+if __name__ == "__main__":
+    '''本地 HTTP/1.1 服务上对比: 每次新建连接 (urllib), 保持连接的顺序请求, 以及并发请求'''
+    import threading
+    import urllib.error
+    import urllib.request
+    from http.server import ThreadingHTTPServer
+
+    class KeepAliveHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True  # Headers and body are written separately
+
+        def do_GET(self):
+            time.sleep(0.002)  # Some work
+            if "crash" in self.path:
+                status = HTTPStatus.INTERNAL_SERVER_ERROR
+            elif self.path.startswith("/order"):
+                status = HTTPStatus.OK
+            else:
+                status = HTTPStatus.NOT_FOUND
+            body = b"<html><body>%d</body></html>" % status
+            self.send_response(status)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), KeepAliveHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    base_url = "http://127.0.0.1:%d/" % httpd.server_address[1]
+    paths = ["/order?item=%d" % i if i % 10 else "/crash?%d" % i for i in range(500)]
+
+    start = time.time()
+    for path in paths:
+        try:
+            urllib.request.urlopen(urljoin(base_url, path)).read()
+        except urllib.error.HTTPError:
+            pass
+    print("new connection per request: %6.0f req/s" % (len(paths) / (time.time() - start)))
+
+    runner = AsyncWebRunner(base_url)
+    start = time.time()
+    outcomes = [runner.run(path)[1] for path in paths]
+    print("keep-alive, sequential:     %6.0f req/s, %d connection(s)" %
+          (len(paths) / (time.time() - start), runner.connections))
+    runner.close()
+
+    runner = AsyncWebRunner(base_url, concurrency=16)
+    start = time.time()
+    results = dict(runner.run_many(paths))
+    print("keep-alive, concurrency 16: %6.0f req/s, %d connection(s)" %
+          (len(paths) / (time.time() - start), runner.connections))
+    assert [results[urljoin(base_url, path)] for path in paths] == outcomes
+    print({outcome: outcomes.count(outcome) for outcome in set(outcomes)})
+    print(runner.run("/missing"), AsyncWebRunner("http://127.0.0.1:1/").run("/"))
+    runner.close()
+    httpd.shutdown()
+
+    # A chunked response with trailer fields leaves the connection reusable
+    class ChunkedHandler(KeepAliveHandler):
+        def do_GET(self):
+            self.send_response(HTTPStatus.OK)
+            self.send_header("Transfer-Encoding", "chunked")
+            self.send_header("Trailer", "X-Checksum")
+            self.end_headers()
+            self.wfile.write(b"5\r\nhello\r\n0\r\nX-Checksum: 42\r\n\r\n")
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), ChunkedHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    runner = AsyncWebRunner("http://127.0.0.1:%d/" % httpd.server_address[1])
+    outcomes = [runner.run(path)[1] for path in paths[:20]]
+    assert outcomes == [Runner.PASS] * 20 and runner.connections == 1
+    print("chunked with trailers: %d requests, %d connection(s)" % (len(outcomes), runner.connections))
+    runner.close()
+    httpd.shutdown()
+
+    # A server closing each connection after the response, without saying
+    # so: stale pooled connections are dropped and the request is retried
+    class ClosingHandler(KeepAliveHandler):
+        def do_GET(self):
+            super().do_GET()
+            self.close_connection = True
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), ClosingHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    runner = AsyncWebRunner("http://127.0.0.1:%d/" % httpd.server_address[1], concurrency=4)
+    outcomes = [outcome for (url, outcome) in runner.run_many(paths[:20])]
+    outcomes += [runner.run(path)[1] for path in paths[:20]]
+    assert outcomes.count(Runner.UNRESOLVED) == 0
+    print("closing server: %d requests, %d connection(s)" % (len(outcomes), runner.connections))
+    runner.close()
+    httpd.shutdown()
+
+
 if __name__ == "__main__":
     print('\n### A WebFormFuzzer')
     httpd_url = "https://www.baidu.com/"
@@ -379,4 +671,4 @@ if __name__ == "__main__":
     web_form_runner = WebRunner(httpd_url)
     out = web_form_fuzzer.runs(web_form_runner, 100000)
     print(out)
-    time.sleep(0.1)
\ No newline at end of file
+    time.sleep(0.1)